@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+
+import decoupy
+from decoupy.main import main
+from decoupy.profiling import Profiler, PHASES
+from benchmarks.tree import generate_tree
+
+CASES = OrderedDict([
+    ('small', dict(modules=500, fanout=5, depth=2)),
+    ('medium', dict(modules=5000, fanout=6, depth=3)),
+    ('cyclic', dict(modules=2000, fanout=6, depth=3, cycle_density=0.5)),
+    ('stdlib', dict(modules=2000, fanout=6, depth=3, stdlib_ratio=0.8)),
+    ('large', dict(modules=20000, fanout=8, depth=4)),
+])
+DEFAULT_CASES = ('small', 'medium', 'cyclic', 'stdlib')
+# Timings that moved by less than this many seconds are treated as noise.
+NOISE_FLOOR = 0.01
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def time_phases(a_pathname, b_pathname):
+    profiler = Profiler(slowest=0)
+    main(a_pathname, b_pathname, profiler=profiler)
+    return profiler.phases
+
+
+def time_main(a_pathname, b_pathname):
+    start = time.time()
+    out = main(a_pathname, b_pathname)
+    wall = time.time() - start
+    return {
+        'wall': wall,
+        'peak_rss_kb': peak_rss_kb(),
+        'sources': len(out),
+        'edges': sum(len(dependencies) for dependencies in out.values()),
+    }
+
+
+def _child(queue, func, args):
+    try:
+        queue.put((True, func(*args)))
+    except Exception as e:
+        queue.put((False, '%s: %s' % (type(e).__name__, e)))
+
+
+def in_child(func, *args):
+    # Every measurement runs in a fresh process so that peak RSS and the
+    # import machinery's caches are not carried over between runs.
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(queue, func, args))
+    process.start()
+    ok, result = queue.get()
+    process.join()
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+
+def run_case(name, params, workdir, repeat=1):
+    a_pathname, b_pathname = generate_tree(os.path.join(workdir, name), **params)
+    runs = [in_child(time_main, a_pathname, b_pathname) for _ in range(repeat)]
+    phase_runs = [in_child(time_phases, a_pathname, b_pathname) for _ in range(repeat)]
+    result = min(runs, key=lambda run: run['wall'])
+    result['peak_rss_kb'] = min(run['peak_rss_kb'] for run in runs)
+    result['phases'] = OrderedDict((phase, min(run[phase] for run in phase_runs)) for phase in PHASES)
+    result['params'] = params
+    return result
+
+
+def run_benchmarks(cases, workdir, repeat=1, stream=None):
+    report = OrderedDict([
+        ('decoupy', decoupy.__version__),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.platform()),
+        ('cases', OrderedDict()),
+    ])
+    for name, params in cases:
+        result = run_case(name, params, workdir, repeat)
+        report['cases'][name] = result
+        if stream is not None:
+            stream.write('%-8s %8.3fs %8d KB  %s\n' % (
+                name, result['wall'], result['peak_rss_kb'],
+                '  '.join('%s %.3fs' % (phase, result['phases'][phase]) for phase in PHASES)))
+            stream.flush()
+    return report
+
+
+def metrics(result):
+    values = OrderedDict([('wall', result['wall']), ('peak_rss_kb', result['peak_rss_kb'])])
+    for phase in PHASES:
+        values[phase] = result['phases'][phase]
+    return values
+
+
+def compare(baseline, report, threshold=0.1, stream=sys.stdout):
+    # Returns the (case, metric, ratio) triples that got worse by more than
+    # threshold relative to the baseline. Timings that changed by less than
+    # NOISE_FLOOR are never reported.
+    regressions = []
+    for name, result in report['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        if baseline['cases'][name]['params'] != result['params']:
+            stream.write('%s: parameters changed, not compared\n' % name)
+            continue
+        before = metrics(baseline['cases'][name])
+        for metric, value in metrics(result).items():
+            ratio = float(value) / before[metric] if before[metric] else 1.0
+            flag = ''
+            if ratio > 1 + threshold and (metric == 'peak_rss_kb' or value - before[metric] > NOISE_FLOOR):
+                regressions.append((name, metric, ratio))
+                flag = '  REGRESSION'
+            stream.write('%-8s %-12s %12.3f -> %12.3f  x%.2f%s\n' % (
+                name, metric, before[metric], value, ratio, flag))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench',
+                                     description='Time decoupy on generated package trees.')
+    parser.add_argument('cases', nargs='*', metavar='case',
+                        help='cases to run: %s (default: %s)' % (', '.join(CASES), ' '.join(DEFAULT_CASES)))
+    parser.add_argument('--modules', type=int, help='run a custom case with this many modules')
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--cycle-density', type=float, default=0.1)
+    parser.add_argument('--stdlib-ratio', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='keep the best of this many runs')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default 0.1)')
+    parser.add_argument('--workdir', help='where to generate trees (default: a temporary directory)')
+    return parser
+
+
+def run(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    names = args.cases or (() if args.modules is not None else DEFAULT_CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error('unknown case %r' % name)
+    cases = [(name, CASES[name]) for name in names]
+    if args.modules is not None:
+        cases.append(('custom', dict(modules=args.modules, fanout=args.fanout, depth=args.depth,
+                                     cycle_density=args.cycle_density, stdlib_ratio=args.stdlib_ratio,
+                                     seed=args.seed)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='decoupy-bench-')
+    try:
+        report = run_benchmarks(cases, workdir, args.repeat, sys.stdout)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
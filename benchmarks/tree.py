@@ -0,0 +1,61 @@
+import os
+import random
+import shutil
+
+INIT_FILE = '__init__.py'
+ROOT = 'synth'
+TOP_PACKAGES = ('pkg_a', 'pkg_b')
+STDLIB = ('os', 'sys', 're', 'json', 'collections', 'itertools', 'functools', 'socket',
+          'os.path', 'logging', 'subprocess', 'xml.dom.minidom', 'email.mime.text')
+
+
+def generate_tree(base, modules=1000, fanout=5, depth=3, branches=3, cycle_density=0.1,
+                  stdlib_ratio=0.3, seed=0):
+    # Writes a synthetic project under base/synth and returns its two top
+    # packages. Modules are spread over packages nested `depth` levels deep,
+    # each with `branches` sub-packages. Every module has `fanout` imports:
+    # stdlib_ratio of them name a stdlib module, the rest a generated module.
+    # Those point only to later modules, except for a cycle_density share that
+    # may point anywhere and so closes import cycles.
+    rng = random.Random(seed)
+    root = os.path.join(base, ROOT)
+    shutil.rmtree(root, ignore_errors=True)
+    packages = []
+    for top in TOP_PACKAGES:
+        level = [(top,)]
+        for _ in range(depth):
+            packages.extend(level)
+            level = [package + ('sub%d' % i,) for package in level for i in range(branches)]
+    for package in [()] + packages:
+        os.makedirs(os.path.join(root, *package))
+        open(os.path.join(root, *(package + (INIT_FILE,))), 'w').close()
+
+    names = [rng.choice(packages) + ('m%d' % i,) for i in range(modules)]
+    for i, name in enumerate(names):
+        lines = []
+        for _ in range(fanout):
+            if rng.random() < stdlib_ratio:
+                lines.append('import %s' % rng.choice(STDLIB))
+                continue
+            if rng.random() < cycle_density:
+                target = names[rng.randrange(modules)]
+            elif i + 1 < modules:
+                target = names[rng.randrange(i + 1, modules)]
+            else:
+                continue
+            if target == name:
+                continue
+            dotted = '.'.join((ROOT,) + target)
+            if rng.random() < 0.5:
+                lines.append('import %s' % dotted)
+            else:
+                lines.append('from %s import %s' % (dotted.rpartition('.')[0], target[-1]))
+        lines.extend([
+            '',
+            '',
+            'def %s(value):' % name[-1],
+            '    return [item for item in value if item]',
+        ])
+        with open(os.path.join(root, *name) + '.py', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return tuple(os.path.join(root, top) for top in TOP_PACKAGES)
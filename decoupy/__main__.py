@@ -0,0 +1,5 @@
+import sys
+
+from decoupy.cli import run
+
+sys.exit(run())
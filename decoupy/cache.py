@@ -0,0 +1,93 @@
+import os
+import sys
+import marshal
+import hashlib
+import platform
+
+import decoupy
+
+CACHE_PREFIX = 'imports-'
+
+
+def cache_tag(prefix=CACHE_PREFIX):
+    return '%s%s%d%d-%s' % (prefix, platform.python_implementation().lower(),
+                            sys.version_info[0], sys.version_info[1], decoupy.__version__)
+
+
+def file_digest(pathname):
+    with open(pathname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def write_cache_file(directory, prefix, data):
+    # Writes data under the current cache_tag(prefix) and removes files left
+    # by other interpreters or decoupy versions.
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pathname = os.path.join(directory, cache_tag(prefix))
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name != cache_tag(prefix):
+            os.remove(os.path.join(directory, name))
+    tmp_pathname = '%s.%d.tmp' % (pathname, os.getpid())
+    with open(tmp_pathname, 'wb') as f:
+        marshal.dump(data, f)
+    os.rename(tmp_pathname, pathname)
+
+
+def read_cache_file(directory, prefix):
+    try:
+        with open(os.path.join(directory, cache_tag(prefix)), 'rb') as f:
+            return marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+class ParseCache(object):
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if directory is not None:
+            self.load()
+
+    @property
+    def pathname(self):
+        return os.path.join(self.directory, cache_tag())
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def load(self):
+        self.entries = read_cache_file(self.directory, CACHE_PREFIX) or {}
+
+    def save(self):
+        if self.directory is None or not self._dirty:
+            return
+        write_cache_file(self.directory, CACHE_PREFIX, self.entries)
+        self._dirty = False
+
+    def get(self, pathname):
+        entry = self.entries.get(pathname)
+        if entry is None:
+            self.misses += 1
+            return None
+        mtime, size, digest, imports = entry
+        st = os.stat(pathname)
+        if (st.st_mtime, st.st_size) != (mtime, size):
+            if st.st_size != size or file_digest(pathname) != digest:
+                self.misses += 1
+                return None
+            self.entries[pathname] = (st.st_mtime, size, digest, imports)
+            self._dirty = True
+        self.hits += 1
+        return imports
+
+    def put(self, pathname, imports):
+        st = os.stat(pathname)
+        self.entries[pathname] = (st.st_mtime, st.st_size, file_digest(pathname), imports)
+        self._dirty = True
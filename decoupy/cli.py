@@ -0,0 +1,441 @@
+import os
+import sys
+import errno
+import argparse
+
+# Only what parsing the command line needs is imported here; every command
+# imports the rest itself, so `--help` and short commands such as query
+# start without loading the analysis, multiprocessing, json or pickle.
+from decoupy.discovery import DEFAULT_EXCLUDES
+
+
+def write_text_record(source, dependencies, stream):
+    stream.write('%s\n' % source.pathname)
+    for dependency in sorted(dependencies):
+        stream.write('    %s %s\n' % (dependency.package, dependency.pathname))
+
+
+def write_jsonl_record(source, dependencies, stream):
+    import json
+    from decoupy.coupling import coupling_record
+    stream.write(json.dumps(coupling_record(source, dependencies), sort_keys=True) + '\n')
+
+
+DEFAULT_SOCKET = '.decoupy.sock'
+WRITERS = {
+    'text': write_text_record,
+    'jsonl': write_jsonl_record,
+}
+
+
+def write_records(records, stream, format='text'):
+    writer = WRITERS[format]
+    for source, dependencies in records:
+        writer(source, dependencies, stream)
+        stream.flush()
+
+
+def scan_command(args):
+    profiler = new_profiler(args)
+    if args.shard is not None and args.snapshot is not None:
+        sys.stderr.write('decoupy: --snapshot needs a complete scan and cannot be combined with --shard\n')
+        return 2
+    if args.spill is not None:
+        if args.shard is not None:
+            sys.stderr.write('decoupy: --spill cannot be combined with --shard\n')
+            return 2
+        if args.snapshot is not None or args.graph_file is not None:
+            sys.stderr.write('decoupy: --spill keeps no graph in memory to write a snapshot or graph file from\n')
+            return 2
+        from decoupy.storage import StorageError, spilled_couplings
+        try:
+            write_records(spilled_couplings((args.a_pathname, args.b_pathname), args.spill, args.cache_dir,
+                                            profiler, DEFAULT_EXCLUDES + tuple(args.exclude), args.jobs),
+                          sys.stdout, args.format)
+        except StorageError as e:
+            sys.stderr.write('decoupy: %s\n' % e)
+            return 2
+        write_profile(profiler, args.profile)
+        return
+    from decoupy.main import iter_couplings, new_graph, shard_sources
+    from decoupy.coupling import CouplingGraph
+    graph = new_graph((args.a_pathname, args.b_pathname), profiler, DEFAULT_EXCLUDES + tuple(args.exclude))
+    coupling = CouplingGraph()
+    shard = args.shard or (0, 1)
+    sources = shard_sources(graph, *shard) if args.shard is not None else None
+
+    def records():
+        for source, dependencies in iter_couplings(args.a_pathname, args.b_pathname, args.cache_dir,
+                                                   args.jobs, graph, profiler, sources):
+            coupling.add(source, dependencies)
+            yield source, dependencies
+
+    write_records(records(), sys.stdout, args.format)
+    if args.snapshot is not None:
+        from decoupy.snapshot import save_snapshot
+        save_snapshot(args.snapshot, args.a_pathname, args.b_pathname, graph, coupling)
+    if args.graph_file is not None:
+        from decoupy.graphfile import write_graph_file
+        write_graph_file(args.graph_file, coupling, graph, (args.a_pathname, args.b_pathname), shard)
+    write_profile(profiler, args.profile)
+
+
+def new_profiler(args):
+    if not args.profile:
+        return None
+    from decoupy.profiling import Profiler
+    return Profiler(args.profile_slowest)
+
+
+def write_profile(profiler, mode):
+    if mode == 'json':
+        profiler.write_json(sys.stderr)
+    elif mode:
+        profiler.write_summary(sys.stderr)
+
+
+def show_command(args):
+    from decoupy.graphfile import GraphFile
+    with GraphFile(args.graph_file) as graph_file:
+        write_records(graph_file, sys.stdout, args.format)
+
+
+def write_violation_text(found, stream):
+    stream.write('%s: %s -> %s (%s %s -> %s)\n' % (found.rule.line, found.source, found.target, found.rule.kind,
+                                                 found.rule.source, found.rule.target))
+    stream.write('    %s\n' % ' -> '.join(found.chain))
+
+
+def write_violation_jsonl(found, stream):
+    import json
+    record = {
+        'rule': dict(found.rule._asdict()),
+        'source': found.source,
+        'target': found.target,
+        'chain': found.chain,
+    }
+    stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def check_command(args):
+    from decoupy.rules import RuleSet, RuleError, load_rules, module_edges, graph_file_edges
+    try:
+        rules = RuleSet(load_rules(args.rules))
+    except RuleError as e:
+        sys.stderr.write('decoupy: %s\n' % e)
+        return 2
+    if args.graph_file is not None:
+        from decoupy.graphfile import GraphFile
+        with GraphFile(args.graph_file) as graph_file:
+            edges = graph_file_edges(graph_file)
+    elif args.roots:
+        from decoupy.main import build_graph, new_graph
+        graph = new_graph(args.roots, excludes=DEFAULT_EXCLUDES + tuple(args.exclude))
+        build_graph(graph, args.cache_dir, args.jobs)
+        edges = module_edges(graph)
+    else:
+        sys.stderr.write('decoupy: check needs roots or --graph-file\n')
+        return 2
+    writer = write_violation_jsonl if args.format == 'jsonl' else write_violation_text
+    violations = rules.check(edges)
+    for found in violations:
+        writer(found, sys.stdout)
+    return 1 if violations else 0
+
+
+def diff_command(args):
+    from decoupy.revisions import RevisionError, diff_revisions
+    try:
+        added, removed = diff_revisions(args.old, args.new, args.roots, args.cache_dir,
+                                        DEFAULT_EXCLUDES + tuple(args.exclude), args.cross)
+    except (RevisionError, SyntaxError) as e:
+        sys.stderr.write('decoupy: %s\n' % e)
+        return 2
+    import json
+    from decoupy.coupling import coupling_record
+    for change, edges in (('added', added), ('removed', removed)):
+        for source, dependency in edges:
+            if args.format == 'jsonl':
+                record = coupling_record(source, [dependency])
+                record['change'] = change
+                sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+            else:
+                sys.stdout.write('%s %s -> %s %s\n' % ('+' if change == 'added' else '-', source.pathname,
+                                                       dependency.package, dependency.pathname))
+    return 0
+
+
+def merge_command(args):
+    from decoupy.shards import MergeError, merge_graph_files
+    from decoupy.snapshot import SnapshotError
+    try:
+        coupling = merge_graph_files(args.parts, args.output)
+    except (MergeError, SnapshotError) as e:
+        sys.stderr.write('decoupy: %s\n' % e)
+        return 2
+    write_records(coupling, sys.stdout, args.format)
+
+
+def shard_argument(value):
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, such as 2/4')
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('shard %s is not one of 1/%d to %d/%d' % (value, count, count, count))
+    return index - 1, count
+
+
+def snapshot_error(e, pathname):
+    if isinstance(e, EnvironmentError):
+        return '%s: %s' % (e.filename or pathname, e.strerror)
+    return e
+
+
+def update_command(args):
+    from decoupy.incremental import update
+    from decoupy.snapshot import SnapshotError
+    try:
+        out = update(args.snapshot, args.paths, cache_dir=args.cache_dir, git=args.git)
+    except (IOError, SnapshotError) as e:
+        sys.stderr.write('decoupy: %s\n' % snapshot_error(e, args.snapshot))
+        return 2
+    write_records(sorted(out.items()), sys.stdout, args.format)
+
+
+def matrix_pairs(matrix):
+    pairs = {}
+    for i, j, source, dependency in matrix.iter_pairs():
+        pairs.setdefault((i, j), []).append((source.pathname, dependency.package, dependency.pathname))
+    for cell_pairs in pairs.values():
+        cell_pairs.sort()
+    return pairs
+
+
+def write_matrix_text(matrix, stream, with_pairs=False):
+    for i, root in enumerate(matrix.roots):
+        stream.write('[%d] %s\n' % (i, root))
+    width = max([len(str(count)) for row in matrix.counts for count in row] + [3]) + 1
+    stream.write('\n   ' + ''.join('%*s' % (width, '[%d]' % j) for j in range(len(matrix.roots))) + '\n')
+    for i, row in enumerate(matrix.counts):
+        stream.write('[%d]' % i + ''.join('%*d' % (width, count) for count in row) + '\n')
+    if with_pairs:
+        pairs = matrix_pairs(matrix)
+        for i, j, count in matrix.cells():
+            stream.write('\n[%d] -> [%d]: %d\n' % (i, j, count))
+            for source, package, pathname in pairs[i, j]:
+                stream.write('    %s %s %s\n' % (source, package, pathname))
+
+
+def write_matrix_json(matrix, stream, with_pairs=False):
+    import json
+    pairs = matrix_pairs(matrix) if with_pairs else {}
+    cells = []
+    for i, j, count in matrix.cells():
+        cell = {'source': i, 'target': j, 'edges': count}
+        if with_pairs:
+            cell['pairs'] = [{'source': source, 'package': package, 'pathname': pathname}
+                             for source, package, pathname in pairs[i, j]]
+        cells.append(cell)
+    record = {'roots': list(matrix.roots), 'counts': matrix.counts, 'cells': cells}
+    stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def matrix_command(args):
+    from decoupy.matrix import coupling_matrix
+    profiler = new_profiler(args)
+    matrix = coupling_matrix(args.roots, args.cache_dir, args.jobs, profiler, DEFAULT_EXCLUDES + tuple(args.exclude))
+    if args.format == 'json':
+        write_matrix_json(matrix, sys.stdout, args.pairs)
+    else:
+        write_matrix_text(matrix, sys.stdout, args.pairs)
+    write_profile(profiler, args.profile)
+
+
+def serve_command(args):
+    from decoupy.server import serve
+    serve(args.roots, args.socket, args.cache_dir, DEFAULT_EXCLUDES + tuple(args.exclude), args.watch,
+          args.interval)
+
+
+def query_command(args):
+    import json
+    from decoupy.client import query
+    request = {'command': args.request}
+    if args.request == 'coupling' and args.argument is not None:
+        request['pathname'] = os.path.abspath(args.argument)
+    elif args.request == 'dependents':
+        request['package'] = args.argument
+    elif args.request == 'why':
+        if args.argument is None or args.target is None:
+            sys.stderr.write('decoupy: why needs a source and a target module\n')
+            return 2
+        request['source'] = os.path.abspath(args.argument) if args.argument.endswith('.py') else args.argument
+        request['target'] = args.target
+    import socket
+    try:
+        response = query(args.socket, request, args.timeout)
+    except socket.timeout:
+        # Something is listening but busy; it may still answer later.
+        sys.stderr.write('decoupy: the server on %s did not answer within %g seconds\n' % (args.socket, args.timeout))
+        return 2
+    except (socket.error, OSError):
+        sys.stderr.write('decoupy: no server on %s\n' % args.socket)
+        return 2
+    except ValueError:
+        sys.stderr.write('decoupy: unreadable reply from the server on %s\n' % args.socket)
+        return 2
+    sys.stdout.write(json.dumps(response, sort_keys=True) + '\n')
+    return 0 if response.get('ok') else 1
+
+
+def why_command(args):
+    from decoupy.reach import ReachabilityIndex
+    from decoupy.snapshot import SnapshotError, load_snapshot
+    try:
+        index = ReachabilityIndex(load_snapshot(args.snapshot)['graph'])
+    except (IOError, SnapshotError) as e:
+        sys.stderr.write('decoupy: %s\n' % snapshot_error(e, args.snapshot))
+        return 2
+    try:
+        chain = index.chain(args.source, args.target)
+    except KeyError as e:
+        sys.stderr.write('decoupy: %s\n' % e.args[0])
+        return 2
+    if chain is None:
+        sys.stdout.write('%s does not depend on %s\n' % (args.source, args.target))
+        return 1
+    sys.stdout.write(' -> '.join(chain) + '\n')
+    return 0
+
+
+def add_exclude_argument(parser):
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='gitignore-style pattern of files or directories to skip; may be repeated '
+                             '(hidden directories and __pycache__ are always skipped)')
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', nargs='?', const='summary', choices=('summary', 'json'),
+                        help='print phase timings, counters and the slowest modules to stderr')
+    parser.add_argument('--profile-slowest', type=int, default=10, metavar='N',
+                        help='number of slowest modules to report (default 10)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='decoupy',
+                                     description='Report import coupling between two packages.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    scan = subparsers.add_parser('scan', help='analyze two package trees')
+    scan.add_argument('a_pathname')
+    scan.add_argument('b_pathname')
+    scan.add_argument('--cache-dir', help='directory for the persistent parse cache')
+    scan.add_argument('--snapshot', help='write a graph snapshot for later incremental updates')
+    scan.add_argument('--graph-file', help='write the result and the import graph as a binary graph file')
+    scan.add_argument('--shard', type=shard_argument, metavar='I/N',
+                      help='only run the I-th of N deterministic parts of the discovered files; '
+                           'write each part with --graph-file and combine them with merge')
+    scan.add_argument('--spill', metavar='DATABASE',
+                      help='keep the graph and the result in this SQLite database instead of in memory')
+    scan.add_argument('-j', '--jobs', type=int, default=1, help='number of parser processes')
+    scan.add_argument('--format', choices=sorted(WRITERS), default='text',
+                      help='output format; records are written as soon as they are known')
+    add_exclude_argument(scan)
+    add_profile_arguments(scan)
+    scan.set_defaults(func=scan_command)
+
+    matrix = subparsers.add_parser('matrix', help='coupling between every pair of N package trees')
+    matrix.add_argument('roots', nargs='+')
+    matrix.add_argument('--cache-dir', help='directory for the persistent parse cache')
+    matrix.add_argument('-j', '--jobs', type=int, default=1, help='number of parser processes')
+    matrix.add_argument('--format', choices=('text', 'json'), default='text', help='output format')
+    matrix.add_argument('--pairs', action='store_true', help='list the module pairs behind every cell')
+    add_exclude_argument(matrix)
+    add_profile_arguments(matrix)
+    matrix.set_defaults(func=matrix_command)
+
+    serve = subparsers.add_parser('serve', help='keep the graph in memory and answer queries on a Unix socket')
+    serve.add_argument('roots', nargs='+')
+    serve.add_argument('--socket', default=DEFAULT_SOCKET, help='socket path (default %(default)s)')
+    serve.add_argument('--cache-dir', help='directory for the persistent parse cache')
+    serve.add_argument('--watch', choices=('auto', 'inotify', 'poll'), default='auto',
+                       help='how to notice changed files (default: inotify where available)')
+    serve.add_argument('--interval', type=float, default=1.0, help='seconds between polls (default 1)')
+    add_exclude_argument(serve)
+    serve.set_defaults(func=serve_command)
+
+    query = subparsers.add_parser('query', help='ask a running server')
+    query.add_argument('request', choices=('coupling', 'dependents', 'why', 'status', 'refresh', 'ping',
+                                           'shutdown'))
+    query.add_argument('argument', nargs='?',
+                       help='source file for coupling, module name for dependents, source for why')
+    query.add_argument('target', nargs='?', help='target module for why')
+    query.add_argument('--socket', default=DEFAULT_SOCKET, help='socket path (default %(default)s)')
+    query.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for the answer')
+    query.set_defaults(func=query_command)
+
+    check = subparsers.add_parser('check', help='check the import graph against architecture rules')
+    check.add_argument('rules', help='file of "allow|forbid SOURCE -> TARGET" lines with glob patterns on '
+                                     'dotted module names; the last matching rule wins')
+    check.add_argument('roots', nargs='*')
+    check.add_argument('--graph-file', help='check a graph file written by scan instead of analyzing roots')
+    check.add_argument('--cache-dir', help='directory for the persistent parse cache')
+    check.add_argument('-j', '--jobs', type=int, default=1, help='number of parser processes')
+    check.add_argument('--format', choices=('text', 'jsonl'), default='text', help='output format')
+    add_exclude_argument(check)
+    check.set_defaults(func=check_command)
+
+    diff = subparsers.add_parser('diff', help='coupling edges added and removed between two git revisions')
+    diff.add_argument('old', help='old revision')
+    diff.add_argument('new', help='new revision')
+    diff.add_argument('roots', nargs='+', help='package trees inside the git work tree')
+    diff.add_argument('--cross', action='store_true', help='only report edges between different roots')
+    diff.add_argument('--cache-dir', help='directory for the persistent blob parse cache')
+    diff.add_argument('--format', choices=('text', 'jsonl'), default='text', help='output format')
+    add_exclude_argument(diff)
+    diff.set_defaults(func=diff_command)
+
+    merge = subparsers.add_parser('merge', help='combine the graph files of all shards of a scan')
+    merge.add_argument('parts', nargs='+', help='graph files written by scan --shard I/N --graph-file')
+    merge.add_argument('-o', '--output', help='write the merged result as a graph file')
+    merge.add_argument('--format', choices=sorted(WRITERS), default='text', help='output format')
+    merge.set_defaults(func=merge_command)
+
+    show = subparsers.add_parser('show', help='print the result stored in a binary graph file')
+    show.add_argument('graph_file')
+    show.add_argument('--format', choices=sorted(WRITERS), default='text', help='output format')
+    show.set_defaults(func=show_command)
+
+    why = subparsers.add_parser('why', help='show the shortest import chain from a module or file to a module')
+    why.add_argument('snapshot', help='snapshot written by scan --snapshot')
+    why.add_argument('source', help='module name, or a source file taken as a script')
+    why.add_argument('target', help='module name or file')
+    why.set_defaults(func=why_command)
+
+    update = subparsers.add_parser('update', help='re-analyze changed files against a snapshot')
+    update.add_argument('snapshot')
+    update.add_argument('paths', nargs='*', help='changed files')
+    update.add_argument('--git', metavar='RANGE', help='take changed files from `git diff --name-only RANGE`')
+    update.add_argument('--cache-dir', help='directory for the persistent parse cache')
+    update.add_argument('--format', choices=sorted(WRITERS), default='text', help='output format')
+    update.set_defaults(func=update_command)
+    return parser
+
+
+def run(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 2
+    try:
+        return args.func(args) or 0
+    except (IOError, OSError) as e:
+        if e.errno != errno.EPIPE:
+            raise
+        # The reader stopped early, as `decoupy scan A B | head` does. Later
+        # writes and the flush at exit would fail the same way, so stdout
+        # goes to devnull and the command ends without a traceback.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
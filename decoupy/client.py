@@ -0,0 +1,27 @@
+import json
+import socket
+
+MAX_REQUEST = 1 << 20
+
+
+def read_line(connection):
+    data = b''
+    while not data.endswith(b'\n') and len(data) < MAX_REQUEST:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def query(socket_path, request, timeout=None):
+    # The client half of the server's protocol, apart from the server so
+    # that `decoupy query` loads nothing of the analysis.
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        return json.loads(read_line(connection).decode('utf-8'))
+    finally:
+        connection.close()
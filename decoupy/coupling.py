@@ -0,0 +1,87 @@
+from array import array
+from collections import namedtuple
+
+module_meta = namedtuple('module', 'package pathname'.split())
+
+
+def coupling_record(source, dependencies):
+    return {
+        'source': {'package': source.package, 'pathname': source.pathname},
+        'dependencies': [{'package': dependency.package, 'pathname': dependency.pathname}
+                         for dependency in sorted(dependencies)],
+    }
+
+
+class CouplingGraph(object):
+    # Sources and dependencies are interned as integer ids into one table of
+    # (package, pathname) pairs, and the dependencies of source i are
+    # targets[offsets[i]:offsets[i + 1]]. On a 10k module tree this keeps the
+    # result in a few arrays instead of one set of namedtuples per source.
+    __slots__ = ('packages', 'pathnames', 'sources', 'offsets', 'targets', '_ids')
+
+    def __init__(self):
+        self.packages = []
+        self.pathnames = []
+        self.sources = array('i')
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self._ids = {}
+
+    def __getstate__(self):
+        return (self.packages, self.pathnames, self.sources, self.offsets, self.targets)
+
+    def __setstate__(self, state):
+        self.packages, self.pathnames, self.sources, self.offsets, self.targets = state
+        self._ids = dict(((package, pathname), i) for i, (package, pathname)
+                         in enumerate(zip(self.packages, self.pathnames)))
+
+    @classmethod
+    def from_items(cls, items):
+        coupling = cls()
+        for source, dependencies in items:
+            coupling.add(source, dependencies)
+        return coupling
+
+    def intern(self, package, pathname):
+        key = (package, pathname)
+        try:
+            return self._ids[key]
+        except KeyError:
+            i = self._ids[key] = len(self.packages)
+            self.packages.append(package)
+            self.pathnames.append(pathname)
+            return i
+
+    def append(self, source_id, target_ids):
+        self.sources.append(source_id)
+        self.targets.extend(sorted(target_ids))
+        self.offsets.append(len(self.targets))
+
+    def add(self, source, dependencies):
+        self.append(self.intern(*source), [self.intern(*dependency) for dependency in dependencies])
+
+    def module(self, i):
+        return module_meta(self.packages[i], self.pathnames[i])
+
+    def dependency_ids(self, position):
+        return self.targets[self.offsets[position]:self.offsets[position + 1]]
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        modules = {}
+        for position, source_id in enumerate(self.sources):
+            dependencies = set()
+            for i in self.dependency_ids(position):
+                module = modules.get(i)
+                if module is None:
+                    module = modules[i] = self.module(i)
+                dependencies.add(module)
+            yield self.module(source_id), dependencies
+
+    def edge_count(self):
+        return len(self.targets)
+
+    def to_dict(self):
+        return dict(self)
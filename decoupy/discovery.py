@@ -0,0 +1,154 @@
+import os
+import re
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+SOURCE_SUFFIX = '.py'
+DEFAULT_EXCLUDES = ('.*/', '__pycache__/')
+
+
+class ExcludeRules(object):
+    # gitignore-style patterns matched against '/'-separated paths relative
+    # to the root being walked. A pattern without a slash matches a name at
+    # any depth, a leading slash anchors it to the root, a trailing slash
+    # limits it to directories and '!' re-includes what an earlier pattern
+    # excluded. The last matching pattern wins.
+
+    def __init__(self, patterns=()):
+        self.patterns = tuple(patterns)
+        self._rules = []
+        for pattern in self.patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            regex = translate(pattern.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            self._rules.append((re.compile(regex + r'\Z'), negate, dir_only))
+
+    def __getstate__(self):
+        return self.patterns
+
+    def __setstate__(self, patterns):
+        self.__init__(patterns)
+
+    def match(self, relative, is_dir=False):
+        excluded = False
+        for regex, negate, dir_only in self._rules:
+            if (is_dir or not dir_only) and regex.match(relative):
+                excluded = not negate
+        return excluded
+
+
+def translate(pattern):
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            parts.append('(?:/.*)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append('[%s]' % body.replace('\\', '\\\\'))
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(parts)
+
+
+def discover(roots, excludes=DEFAULT_EXCLUDES):
+    # Yields the .py files under roots, each joined to the root it was found
+    # under. Directories are identified by (st_dev, st_ino) and entered once
+    # across all roots, which breaks symlink loops and keeps a root nested
+    # in an earlier one from being walked twice.
+    if not isinstance(excludes, ExcludeRules):
+        excludes = ExcludeRules(excludes or ())
+    visited = set()
+    for root in roots:
+        for pathname in _walk(root, excludes, visited):
+            yield pathname
+
+
+def _walk(root, excludes, visited):
+    pending = [(root, '')]
+    while pending:
+        directory, relative = pending.pop()
+        try:
+            st = os.stat(directory)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            entries = sorted(_entries(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            name = relative + entry.name
+            if entry.name.endswith(SOURCE_SUFFIX) and _is_file(entry):
+                if not excludes.match(name):
+                    yield os.path.join(directory, entry.name)
+            elif _is_dir(entry) and not excludes.match(name, True):
+                subdirs.append((os.path.join(directory, entry.name), name + '/'))
+        pending.extend(reversed(subdirs))
+
+
+def _is_file(entry):
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+class _DirEntry(object):
+    __slots__ = ('name', 'path')
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+
+def _entries(directory):
+    if scandir is not None:
+        return scandir(directory)
+    return [_DirEntry(directory, name) for name in os.listdir(directory)]
@@ -0,0 +1,355 @@
+import os
+from decoupy.cache import ParseCache
+from decoupy.resolver import Resolver
+from decoupy.scanner import file_imports
+from decoupy.profiling import clock
+
+MAIN = '__main__'
+
+
+class ImportGraph(object):
+
+    def __init__(self, path=None, index=None):
+        self.path = path
+        self.index = index
+        self.files = {}
+        self.edges = {}
+        self.scripts = {}
+        self.misses = {}
+        self._closures = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_closures'] = None
+        return state
+
+    def add_module(self, name, pathname):
+        self.files[name] = pathname
+        self.edges.setdefault(name, set())
+
+    def remove_module(self, name):
+        self.files.pop(name, None)
+        self.misses.pop(name, None)
+        self.edges.pop(name, None)
+        for targets in self.edges.values():
+            targets.discard(name)
+        self._closures = None
+
+    def set_imports(self, name, targets, misses=()):
+        self.edges[name] = set(targets)
+        for target in targets:
+            self.edges.setdefault(target, set())
+        if misses:
+            self.misses[name] = set(misses)
+        else:
+            self.misses.pop(name, None)
+        # Closures are final once every module they reach has been scanned,
+        # so only re-scanning a module that already has one invalidates them.
+        if self._closures is not None and name in self._closures:
+            self._closures = None
+
+    def add_script(self, pathname, targets, misses=()):
+        self.scripts[pathname] = set(targets)
+        for target in targets:
+            self.edges.setdefault(target, set())
+        if misses:
+            self.misses[pathname] = set(misses)
+        else:
+            self.misses.pop(pathname, None)
+
+    def remove_script(self, pathname):
+        self.scripts.pop(pathname, None)
+        self.misses.pop(pathname, None)
+
+    def reverse_edges(self):
+        reverse = dict((name, set()) for name in self.edges)
+        for source, targets in self.edges.items():
+            for target in targets:
+                reverse[target].add(source)
+        return reverse
+
+    def closure(self, name):
+        if self._closures is None:
+            self._closures = {}
+        if name not in self._closures:
+            strongly_connected_closures(self.edges, [name], self._closures)
+        return self._closures[name]
+
+    def script_closure(self, pathname):
+        out = set()
+        for target in self.scripts[pathname]:
+            out.update(self.closure(target))
+        return out
+
+
+def strongly_connected_closures(edges, roots=None, closures=None):
+    # SCCs are emitted sinks first, so the closure of every successor
+    # component is already known when a component is closed and all members
+    # of a component share one frozenset. With roots given only the part of
+    # the graph reachable from them is visited; nodes already in closures
+    # are treated as finished.
+    if closures is None:
+        closures = {}
+    for component in strongly_connected_components(edges, roots, closures):
+        reached = set(component)
+        for member in component:
+            for succ in edges[member]:
+                if succ not in reached:
+                    reached.update(closures[succ])
+        reached = frozenset(reached)
+        for member in component:
+            closures[member] = reached
+    return closures
+
+
+def strongly_connected_components(edges, roots=None, done=()):
+    # Iterative Tarjan yielding each component as a list, sinks first.
+    # Nodes in done are skipped as if their components had been yielded.
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    counter = 0
+    for root in (edges if roots is None else roots):
+        if root in index or root in done:
+            continue
+        work = [(root, iter(edges[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for succ in successors:
+                if succ in done:
+                    continue
+                if succ not in index:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(edges[succ])))
+                    break
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    yield component
+
+
+class GraphBuilder(object):
+
+    def __init__(self, graph, cache=None, profiler=None, resolver=None):
+        self.graph = graph
+        self.index = graph.index
+        self.cache = cache if cache is not None else ParseCache()
+        self.resolver = resolver if resolver is not None else Resolver()
+        self.profiler = profiler
+        self._found = {}
+        self._imports = {}
+        self._pending = []
+
+    def preload(self, pathnames, workers=1):
+        if self.profiler is not None:
+            start = clock()
+        missing = []
+        for pathname in pathnames:
+            imports = self.cache.get(pathname)
+            if imports is None:
+                missing.append(pathname)
+            else:
+                self._imports[pathname] = imports
+        if workers > 1 and len(missing) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            try:
+                chunksize = max(1, len(missing) // (workers * 4))
+                parsed = list(pool.imap(parse_source, missing, chunksize))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            parsed = [parse_source(pathname) for pathname in missing]
+        for pathname, imports in zip(missing, parsed):
+            # Files that failed to parse are left to file_imports, which
+            # raises the parse error when the file is actually scanned.
+            if imports is not None:
+                self.cache.put(pathname, imports)
+                self._imports[pathname] = imports
+        if self.profiler is not None:
+            self.profiler.count('modules_parsed', len(missing))
+            self.profiler.since('parsing', start)
+
+    def add_parsed(self, imports):
+        # Imports known without reading the files, by pathname.
+        self._imports.update(imports)
+
+    def imports(self, pathname):
+        imports = self._imports.get(pathname)
+        if imports is None:
+            imports = self.cache.get(pathname)
+        if imports is None:
+            imports = file_imports(pathname)
+            self.cache.put(pathname, imports)
+            if self.profiler is not None:
+                self.profiler.count('modules_parsed')
+        self._imports[pathname] = imports
+        return imports
+
+    def run_script(self, pathname):
+        # The file runs as __main__, so implicit relative imports stay
+        # absolute, but its explicit relative imports are taken relative to
+        # the module the file is in the roots.
+        name = self.index.name_for(pathname)
+        anchor = (name, self.index.is_package(name)) if name is not None else None
+        targets, misses = self.resolve_file(MAIN, False, pathname, anchor)
+        self.graph.add_script(pathname, targets, misses)
+        self._add_targets(targets)
+        self.drain()
+
+    def rescan(self, name):
+        if self.index.lookup(name) is not None:
+            self.scan(name)
+            self.drain()
+
+    def remove(self, name):
+        self.index.remove(self.index.lookup(name))
+        self.graph.remove_module(name)
+
+    def scan(self, name):
+        targets, misses = self.resolve_file(name, self.index.is_package(name), self.index.lookup(name))
+        self.graph.set_imports(name, targets, misses)
+        self._add_targets(targets)
+
+    def resolve_file(self, caller, is_package, pathname, anchor=None):
+        if self.profiler is None:
+            return self.resolve(caller, is_package, self.imports(pathname), anchor)
+        start = clock()
+        imports = self.imports(pathname)
+        parsed = self.profiler.since('parsing', start)
+        resolved = self.resolve(caller, is_package, imports, anchor)
+        self.profiler.module_time(pathname, self.profiler.since('resolution', parsed) - start)
+        return resolved
+
+    def drain(self):
+        while self._pending:
+            self.scan(self._pending.pop())
+
+    def _add_targets(self, targets):
+        for target in targets:
+            if target not in self.graph.files:
+                self.graph.add_module(target, self.find(target)[0])
+                if self.index.lookup(target) is not None:
+                    self._pending.append(target)
+
+    def find(self, name):
+        # Returns (pathname, package search dirs) or None. Names inside the
+        # roots are answered by the index; everything else is only located
+        # on the search path and never opened.
+        try:
+            return self._found[name]
+        except KeyError:
+            pass
+        if self.index.owns(name):
+            pathname = self.index.lookup(name)
+            if pathname is None:
+                found = None
+            elif self.index.is_package(name):
+                found = (pathname, [os.path.dirname(pathname)])
+            else:
+                found = (pathname, None)
+        else:
+            parent, _, partname = name.rpartition('.')
+            if not parent:
+                found = self.resolver.find(partname, self.graph.path, builtins=True)
+            else:
+                parent_found = self.find(parent)
+                if parent_found is None or parent_found[1] is None:
+                    found = None
+                else:
+                    found = self.resolver.find(partname, parent_found[1])
+            if found is not None and self.profiler is not None:
+                self.profiler.count('external_modules')
+        self._found[name] = found
+        return found
+
+    def resolve(self, caller, is_package, imports, anchor=None):
+        # Follows ModuleFinder.import_hook: every package on the way to an
+        # imported module and every submodule named in a from-list becomes
+        # an edge; names that could not be found are kept as misses. anchor,
+        # a (name, is_package) pair, stands in for the caller in explicit
+        # relative imports.
+        targets = set()
+        misses = set()
+        for level, fromlist, name in imports:
+            importer, importer_is_package = anchor if anchor is not None and level > 0 else (caller, is_package)
+            try:
+                if level > 0 and not name:
+                    name, level = determine_parent(importer, importer_is_package, level), 0
+                parent = determine_parent(importer, importer_is_package, level)
+            except ImportError:
+                continue
+            module = self._import_name(parent, name, level, targets, misses)
+            if module is None or not fromlist or self.find(module)[1] is None:
+                continue
+            for sub in fromlist:
+                if sub != '*':
+                    self._import_module(module + '.' + sub, targets, misses)
+        return targets, misses
+
+    def _import_name(self, parent, name, level, targets, misses):
+        head, _, tail = name.partition('.')
+        module = None
+        if parent:
+            module = self._import_module(parent + '.' + head, targets, misses)
+        if module is None and (parent is None or level < 0):
+            module = self._import_module(head, targets, misses)
+        for part in tail.split('.') if tail else ():
+            if module is None:
+                break
+            module = self._import_module(module + '.' + part, targets, misses)
+        return module
+
+    def _import_module(self, name, targets, misses):
+        if self.find(name) is None:
+            misses.add(name)
+            return None
+        targets.add(name)
+        return name
+
+
+def determine_parent(caller, is_package, level):
+    if caller is None or level == 0:
+        return None
+    if level >= 1:
+        if is_package:
+            level -= 1
+        if level == 0:
+            return caller
+        if caller.count('.') < level:
+            raise ImportError('relative import path too deep')
+        return '.'.join(caller.split('.')[:-level])
+    if is_package:
+        return caller
+    if '.' in caller:
+        return caller.rpartition('.')[0]
+    return None
+
+
+def parse_source(pathname):
+    try:
+        return file_imports(pathname)
+    except (SyntaxError, TypeError, ValueError, IOError, OSError):
+        return None
+
@@ -0,0 +1,314 @@
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+from decoupy.coupling import CouplingGraph, module_meta
+from decoupy.snapshot import SnapshotError
+
+MAGIC = b'DECOUPY\0'
+GRAPH_FILE_VERSION = 2
+HEADER = struct.Struct('<8sII')
+SECTION = struct.Struct('<QQ')
+ALIGNMENT = 8
+
+# Sections in file order. Every section but STRING_DATA is an array of
+# little-endian 32-bit ints; STRING_DATA is the UTF-8 text of all strings,
+# string i being STRING_DATA[STRING_OFFSETS[i]:STRING_OFFSETS[i + 1]].
+SECTIONS = (
+    'root_ids',          # string ids of the analyzed roots
+    'shard',             # [index, count] of the shard the file holds
+    'string_offsets',
+    'string_data',
+    'module_packages',   # module table: string ids of (package, pathname)
+    'module_pathnames',
+    'sources',           # coupling CSR: module ids of the sources,
+    'offsets',           # dependencies of source i are
+    'targets',           # targets[offsets[i]:offsets[i + 1]]
+    'positions',         # discovery position of every source
+    'node_names',        # import graph: string id of every module name and
+    'node_pathnames',    # of its file, -1 when it has none
+    'import_offsets',    # modules imported by node i, as node ids
+    'import_targets',
+    'scripts',           # string ids of the scripts and their direct
+    'script_offsets',    # imports, as node ids
+    'script_targets',
+)
+
+
+class StringTable(object):
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array('i', [0])
+        self.data = []
+        self.size = 0
+
+    def intern(self, string):
+        if string is None:
+            return -1
+        try:
+            return self.ids[string]
+        except KeyError:
+            encoded = string if isinstance(string, bytes) else string.encode('utf-8')
+            self.data.append(encoded)
+            self.size += len(encoded)
+            self.offsets.append(self.size)
+            i = self.ids[string] = len(self.ids)
+            return i
+
+
+def write_graph_file(pathname, coupling, graph=None, roots=(), shard=(0, 1), positions=None):
+    # Lays the coupling result, and the import graph when given, out as a
+    # string table, a module table and CSR arrays, and writes the whole file
+    # with one write into a temporary file that is renamed into place.
+    # Positions default to the order of the graph's discovered files, or
+    # to the order of the result without one.
+    strings = StringTable()
+    sections = {}
+    sections['root_ids'] = array('i', [strings.intern(root) for root in roots])
+    sections['shard'] = array('i', shard)
+    if positions is None:
+        if graph is not None and graph.index is not None:
+            order = dict((source, i) for i, source in enumerate(graph.index.sources))
+            positions = [order[coupling.pathnames[source]] for source in coupling.sources]
+        else:
+            positions = range(len(coupling.sources))
+    sections['positions'] = array('i', positions)
+    sections['module_packages'] = array('i', [strings.intern(package) for package in coupling.packages])
+    sections['module_pathnames'] = array('i', [strings.intern(name) for name in coupling.pathnames])
+    sections['sources'] = coupling.sources
+    sections['offsets'] = coupling.offsets
+    sections['targets'] = coupling.targets
+    names = sorted(graph.edges) if graph is not None else []
+    nodes = dict((name, i) for i, name in enumerate(names))
+    sections['node_names'] = array('i', [strings.intern(name) for name in names])
+    sections['node_pathnames'] = array('i', [strings.intern(graph.files.get(name)) for name in names])
+    sections['import_offsets'], sections['import_targets'] = _csr(
+        [graph.edges[name] for name in names], nodes)
+    scripts = sorted(graph.scripts) if graph is not None else []
+    sections['scripts'] = array('i', [strings.intern(script) for script in scripts])
+    sections['script_offsets'], sections['script_targets'] = _csr(
+        [graph.scripts[script] for script in scripts], nodes)
+    sections['string_offsets'] = strings.offsets
+    sections['string_data'] = b''.join(strings.data)
+
+    table = []
+    chunks = []
+    position = HEADER.size + SECTION.size * len(SECTIONS)
+    for name in SECTIONS:
+        data = sections[name]
+        if isinstance(data, array):
+            data = _little_endian(data)
+        padding = -position % ALIGNMENT
+        chunks.append(b'\0' * padding)
+        position += padding
+        table.append(SECTION.pack(position, len(data)))
+        chunks.append(data)
+        position += len(data)
+    header = HEADER.pack(MAGIC, GRAPH_FILE_VERSION, len(SECTIONS))
+    tmp_pathname = '%s.%d.tmp' % (pathname, os.getpid())
+    with open(tmp_pathname, 'wb') as f:
+        f.write(b''.join([header] + table + chunks))
+    os.rename(tmp_pathname, pathname)
+
+
+def _csr(target_sets, ids):
+    offsets = array('i', [0])
+    targets = array('i')
+    for target_set in target_sets:
+        targets.extend(sorted(ids[target] for target in target_set))
+        offsets.append(len(targets))
+    return offsets, targets
+
+
+def _little_endian(ints):
+    if ints.itemsize != 4:
+        ints = array('i', ints)
+    if sys.byteorder != 'little':
+        ints = array('i', ints)
+        ints.byteswap()
+    return ints.tostring() if str is bytes else ints.tobytes()
+
+
+class GraphFile(object):
+    # A graph file mapped read-only into memory. Nothing is decoded on open:
+    # the sections are views into the mapping and strings are decoded when
+    # they are asked for, so opening costs the same for any graph size. The
+    # coupling part reads like a CouplingGraph.
+
+    def __init__(self, pathname):
+        self.pathname = pathname
+        with open(pathname, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise SnapshotError('%s is not a decoupy graph file' % pathname)
+        try:
+            self._open()
+        except (SnapshotError, struct.error):
+            self._map.close()
+            raise
+
+    def _open(self):
+        if len(self._map) < HEADER.size:
+            raise SnapshotError('%s is not a decoupy graph file' % self.pathname)
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError('%s is not a decoupy graph file' % self.pathname)
+        if version != GRAPH_FILE_VERSION or count != len(SECTIONS):
+            raise SnapshotError('%s was written by an incompatible decoupy version' % self.pathname)
+        for i, name in enumerate(SECTIONS):
+            offset, size = SECTION.unpack_from(self._map, HEADER.size + SECTION.size * i)
+            if offset + size > len(self._map):
+                raise SnapshotError('%s is truncated' % self.pathname)
+            if name == 'string_data':
+                self._string_data = (offset, size)
+            else:
+                setattr(self, name, _int_view(self._map, offset, size // 4))
+        self._strings = {}
+        self._ids = None
+
+    def close(self):
+        for name in SECTIONS:
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # A caller still holds a slice of a section; the mapping goes
+            # away with the last one.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def string(self, i):
+        if i < 0:
+            return None
+        try:
+            return self._strings[i]
+        except KeyError:
+            start = self._string_data[0]
+            value = self._map[start + self.string_offsets[i]:start + self.string_offsets[i + 1]].decode('utf-8')
+            self._strings[i] = value
+            return value
+
+    @property
+    def roots(self):
+        return [self.string(i) for i in self.root_ids]
+
+    @property
+    def shard_index(self):
+        return self.shard[0]
+
+    @property
+    def shard_count(self):
+        return self.shard[1]
+
+    def module(self, i):
+        return module_meta(self.string(self.module_packages[i]), self.string(self.module_pathnames[i]))
+
+    def dependency_ids(self, position):
+        return self.targets[self.offsets[position]:self.offsets[position + 1]]
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        modules = {}
+        for position in range(len(self.sources)):
+            dependencies = set()
+            for i in self.dependency_ids(position):
+                module = modules.get(i)
+                if module is None:
+                    module = modules[i] = self.module(i)
+                dependencies.add(module)
+            yield self.module(self.sources[position]), dependencies
+
+    def edge_count(self):
+        return len(self.targets)
+
+    def to_dict(self):
+        return dict(self)
+
+    def coupling_graph(self):
+        # A CouplingGraph copy, for callers that go on to change the result.
+        coupling = CouplingGraph()
+        coupling.__setstate__((
+            [self.string(i) for i in self.module_packages],
+            [self.string(i) for i in self.module_pathnames],
+            array('i', self.sources), array('i', self.offsets), array('i', self.targets),
+        ))
+        return coupling
+
+    def node_count(self):
+        return len(self.node_names)
+
+    def node_name(self, i):
+        return self.string(self.node_names[i])
+
+    def node(self, name):
+        # Node id of a module name; the name index is built on first use.
+        if self._ids is None:
+            self._ids = dict((self.node_name(i), i) for i in range(self.node_count()))
+        return self._ids[name]
+
+    def imports(self, i):
+        return self.import_targets[self.import_offsets[i]:self.import_offsets[i + 1]]
+
+    def import_files(self):
+        return dict((self.node_name(i), self.string(self.node_pathnames[i])) for i in range(self.node_count()))
+
+    def import_edges(self):
+        names = [self.node_name(i) for i in range(self.node_count())]
+        return dict((name, set(names[j] for j in self.imports(i))) for i, name in enumerate(names))
+
+    def script_imports(self):
+        names = [self.node_name(i) for i in range(self.node_count())]
+        return dict((self.string(self.scripts[i]),
+                     set(names[j] for j in self.script_targets[self.script_offsets[i]:self.script_offsets[i + 1]]))
+                    for i in range(len(self.scripts)))
+
+
+class _Ints(object):
+    # Read-only int array over a buffer without memoryview.cast, decoding
+    # items as they are read.
+    __slots__ = ('_buffer', '_offset', '_count')
+
+    def __init__(self, buffer, offset, count):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._count)
+            if step != 1:
+                return list(self)[key]
+            return struct.unpack_from('<%di' % max(0, stop - start), self._buffer, self._offset + 4 * start)
+        if key < 0:
+            key += self._count
+        if not 0 <= key < self._count:
+            raise IndexError(key)
+        return struct.unpack_from('<i', self._buffer, self._offset + 4 * key)[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+def _int_view(buffer, offset, count):
+    if sys.byteorder == 'little' and array('i').itemsize == 4:
+        try:
+            return memoryview(buffer)[offset:offset + 4 * count].cast('i')
+        except (TypeError, AttributeError):
+            pass
+    return _Ints(buffer, offset, count)
@@ -0,0 +1,123 @@
+import os
+import subprocess
+
+from decoupy.cache import ParseCache
+from decoupy.resolver import Resolver
+from decoupy.coupling import CouplingGraph
+from decoupy.graph import GraphBuilder, MAIN
+from decoupy.main import module_meta, traverse_dependencies
+from decoupy.snapshot import load_snapshot, save_snapshot
+
+
+def changed_files_from_git(revision_range, cwd='.'):
+    # Without rename detection a renamed file is listed under both its old
+    # and its new path, so the old one is removed from the graph.
+    toplevel = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
+                                       cwd=cwd, universal_newlines=True).strip()
+    names = subprocess.check_output(['git', 'diff', '--name-only', '--no-renames', revision_range],
+                                    cwd=cwd, universal_newlines=True)
+    return [os.path.join(toplevel, name) for name in names.splitlines() if name]
+
+
+def update(snapshot, changed_paths, cache_dir=None, git=None):
+    # With git, the files changed in that revision range of the repository
+    # holding the snapshot's roots are added to changed_paths.
+    state = load_snapshot(snapshot)
+    a_pathname, b_pathname = state['roots']
+    if git is not None:
+        changed_paths = list(changed_paths) + changed_files_from_git(git, a_pathname)
+    graph = state['graph']
+    out = state['result'].to_dict()
+    builder = GraphBuilder(graph, ParseCache(cache_dir), resolver=Resolver(cache_dir))
+    apply_changes(builder, out, changed_paths)
+    builder.cache.save()
+    builder.resolver.save()
+    save_snapshot(snapshot, a_pathname, b_pathname, graph, CouplingGraph.from_items(sorted(out.items())))
+    return out
+
+
+def apply_changes(builder, out, changed_paths):
+    # Brings builder.graph and the result dict out up to date with the
+    # changed files and returns the sources whose entries were recomputed.
+    recompute = update_graph(builder, changed_paths)
+    for pathname in recompute:
+        out.pop(module_meta(MAIN, pathname), None)
+    traverse_dependencies([pathname for pathname in recompute if pathname in builder.graph.scripts], out,
+                          builder.graph)
+    return recompute
+
+
+def update_graph(builder, changed_paths, exists=os.path.isfile):
+    # Brings builder.graph up to date with the changed files and returns the
+    # sources whose dependencies may have changed, removed ones included.
+    # The builder must be new, since it remembers lookups of names in the
+    # roots. exists tells whether a changed file is still there.
+    graph = builder.graph
+    index = graph.index
+    reverse = graph.reverse_edges()
+
+    changed_names = set()
+    rescan = set()
+    rerun = set()
+    removed = set()
+    for changed in set(changed_paths):
+        # Only files inside the roots are ever scanned, so nothing outside
+        # them can change the result.
+        pathname = index.local_path(changed)
+        if pathname is None:
+            continue
+        name = index.name_for(pathname)
+        if not exists(pathname):
+            if name is not None:
+                rescan.update(reverse.get(name, ()))
+                builder.remove(name)
+                changed_names.add(name)
+            if pathname in graph.scripts:
+                graph.remove_script(pathname)
+                removed.add(pathname)
+            continue
+        if not index.accepts(pathname):
+            continue
+        if name is None:
+            name = index.add(pathname)
+            index.sources.append(pathname)
+            if name is not None:
+                for source, misses in list(graph.misses.items()):
+                    if name in misses:
+                        if source in graph.scripts:
+                            rerun.add(source)
+                        else:
+                            rescan.add(source)
+        else:
+            rescan.add(name)
+        if name is not None:
+            changed_names.add(name)
+        rerun.add(pathname)
+
+    for pathname, targets in graph.scripts.items():
+        if any(target not in graph.edges for target in targets):
+            rerun.add(pathname)
+
+    before = set(graph.files)
+    for name in sorted(rescan):
+        if name in graph.files:
+            builder.rescan(name)
+            changed_names.add(name)
+    for pathname in sorted(rerun):
+        builder.run_script(pathname)
+    changed_names.update(set(graph.files) - before)
+
+    reverse = graph.reverse_edges()
+    affected = set()
+    pending = [name for name in changed_names if name in reverse]
+    while pending:
+        name = pending.pop()
+        if name not in affected:
+            affected.add(name)
+            pending.extend(reverse[name])
+
+    recompute = rerun | removed
+    for pathname, targets in graph.scripts.items():
+        if targets & affected or targets & changed_names:
+            recompute.add(pathname)
+    return sorted(recompute)
@@ -0,0 +1,123 @@
+import os
+
+from decoupy.discovery import DEFAULT_EXCLUDES, SOURCE_SUFFIX, ExcludeRules, discover
+
+INIT_FILE = '__init__.py'
+
+
+def dotted_name(pathname, base):
+    relative = os.path.relpath(pathname, base or os.curdir)
+    if relative.startswith(os.pardir) or not relative.endswith('.py'):
+        return None
+    parts = relative[:-len('.py')].split(os.sep)
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts) or None
+
+
+class ModuleIndex(object):
+
+    def __init__(self, base, roots, excludes=DEFAULT_EXCLUDES, sources=None):
+        # With sources the files are taken from that list, less the ones
+        # discovery would skip, instead of walking the roots.
+        self.base = base
+        self.roots = tuple(roots)
+        self.excludes = ExcludeRules(excludes)
+        self._prefixes = tuple(os.path.join(os.path.abspath(root), '') for root in self.roots)
+        self.paths = {}
+        self.names = {}
+        self.packages = set()
+        # Every discovered file, in discovery order; these are the files
+        # analyzed as scripts.
+        self.sources = []
+        if sources is None:
+            sources = discover(self.roots, self.excludes)
+        else:
+            sources = [pathname for pathname in sources if self.accepts(pathname)]
+        for pathname in sources:
+            self.sources.append(pathname)
+            self.add(pathname)
+
+    def accepts(self, pathname):
+        # True when discovery would have picked up pathname.
+        if not pathname.endswith(SOURCE_SUFFIX):
+            return False
+        absolute = os.path.abspath(pathname)
+        for prefix in self._prefixes:
+            if absolute.startswith(prefix):
+                parts = absolute[len(prefix):].split(os.sep)
+                for i in range(1, len(parts)):
+                    if self.excludes.match('/'.join(parts[:i]), True):
+                        return False
+                return not self.excludes.match('/'.join(parts))
+        return False
+
+    def add(self, pathname):
+        name = dotted_name(pathname, self.base)
+        if name is None or name in self.paths:
+            return name
+        self.paths[name] = pathname
+        self.names[pathname] = name
+        if os.path.basename(pathname) == INIT_FILE:
+            self.packages.add(name)
+        return name
+
+    def remove(self, pathname):
+        name = self.names.pop(pathname, None)
+        if name is not None:
+            del self.paths[name]
+            self.packages.discard(name)
+            if pathname in self.sources:
+                self.sources.remove(pathname)
+        return name
+
+    def lookup(self, name):
+        return self.paths.get(name)
+
+    def name_for(self, pathname):
+        return self.names.get(pathname)
+
+    def is_package(self, name):
+        return name in self.packages
+
+    def init_chain(self, name):
+        parts = name.split('.')
+        chain = []
+        for i in range(1, len(parts)):
+            package = '.'.join(parts[:i])
+            if package in self.packages:
+                chain.append(self.paths[package])
+        return chain
+
+    def owns(self, name):
+        # True when name is, or would be, a module inside the roots, so the
+        # index alone decides whether it exists.
+        while name:
+            if name in self.packages:
+                return True
+            name = name.rpartition('.')[0]
+        return False
+
+    def local_path(self, pathname):
+        # Maps any spelling of a path inside the roots to the one the index
+        # and the discovered file list use.
+        absolute = os.path.abspath(pathname)
+        for root, prefix in zip(self.roots, self._prefixes):
+            if absolute.startswith(prefix):
+                return os.path.join(root, absolute[len(prefix):])
+        return None
+
+    def root_of(self, pathname):
+        # Position of the innermost root containing pathname, so a module in
+        # a nested root belongs to that root and not to the one around it.
+        absolute = os.path.abspath(pathname)
+        found = None
+        for i, prefix in enumerate(self._prefixes):
+            if absolute.startswith(prefix) and (found is None or len(prefix) > len(self._prefixes[found])):
+                found = i
+        return found
+
+    def contains(self, pathname):
+        if pathname in self.names:
+            return True
+        return os.path.abspath(pathname).startswith(self._prefixes)
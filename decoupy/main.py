@@ -1,39 +1,181 @@
 import sys
 import os
-from setuptools import findall
-from modulefinder import ModuleFinder
-from collections import namedtuple
+import zlib
+from decoupy.graph import ImportGraph, GraphBuilder, MAIN
+from decoupy.index import INIT_FILE, ModuleIndex
+from decoupy.discovery import DEFAULT_EXCLUDES
+from decoupy.cache import ParseCache
+from decoupy.resolver import Resolver
+from decoupy.coupling import CouplingGraph, module_meta
+from decoupy.snapshot import save_snapshot
+from decoupy.profiling import clock
 
-module_meta = namedtuple('module', 'package pathname'.split())
 
+def find_common_base_path(*paths):
+    return os.path.dirname(os.path.commonprefix(paths))
 
-def find_common_base_path(path1, path2):
-    return os.path.dirname(os.path.commonprefix([path1, path2]))
 
+def package_base(root, exists=os.path.isfile):
+    # The directory above the outermost package holding root, or root itself
+    # when it is not a package, so that module names are the ones the files
+    # are imported by. exists tells whether a file is there.
+    path = os.path.normpath(os.path.abspath(root))
+    while exists(os.path.join(path, INIT_FILE)):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
 
-def main(a_pathname, b_pathname):
-    modules_a = findall(a_pathname)
-    modules_b = findall(b_pathname)
-    sys_path = [os.path.dirname(find_common_base_path(a_pathname, b_pathname))] + sys.path
-    out = {}
-    traverse_dependencies(modules_a, a_pathname, b_pathname, out, sys_path)
-    traverse_dependencies(modules_b, a_pathname, b_pathname, out, sys_path)
-    return out
 
+def base_path(roots, exists=os.path.isfile):
+    # The directory module names are relative to: the deepest directory
+    # holding the package base of every root.
+    bases = [package_base(root, exists).split(os.sep) for root in roots]
+    common = bases[0]
+    for parts in bases[1:]:
+        i = 0
+        while i < min(len(common), len(parts)) and common[i] == parts[i]:
+            i += 1
+        common = common[:i]
+    return os.sep.join(common) or os.sep
 
-def traverse_dependencies(modules_a, a_pathname, b_pathanme, out, sys_path):
-    for module_pathname in modules_a:
-        mf = ModuleFinder(sys_path)
-        mf.run_script(module_pathname)
-        res = {}
-        for mod_name, mod_obj in mf.modules.iteritems():
-            pathname = mod_obj.__file__
-            if pathname is not None and (a_pathname in pathname or b_pathanme in pathname):
-                res[mod_obj.__file__] = mod_name
-        if len(res) > 1:
-            seek_module = module_meta(res[module_pathname], module_pathname)
-            del res[module_pathname]
-            out[seek_module] = set(module_meta(mod_name, pathname) for pathname, mod_name in res.iteritems())
+
+def main(a_pathname, b_pathname, cache_dir=None, snapshot=None, workers=1, profiler=None,
+         excludes=DEFAULT_EXCLUDES):
+    # Every source is keyed as module_meta('__main__', pathname). A file that
+    # its own imports reach again under its dotted name was once keyed by
+    # whichever of its two names ModuleFinder's dict listed last; the
+    # dependencies were and are the same either way.
+    graph = new_graph((a_pathname, b_pathname), profiler, excludes)
+    coupling = build_coupling(a_pathname, b_pathname, cache_dir, workers, graph, profiler)
+    if snapshot is not None:
+        save_snapshot(snapshot, a_pathname, b_pathname, graph, coupling)
+    return coupling.to_dict()
+
+
+def new_graph(roots, profiler=None, excludes=DEFAULT_EXCLUDES):
+    if profiler is not None:
+        start = clock()
+    base = base_path(roots)
+    graph = ImportGraph([base] + sys.path, ModuleIndex(base, roots, excludes))
+    if profiler is not None:
+        profiler.since('discovery', start)
+        profiler.count('files_found', len(graph.index.sources))
+    return graph
+
+
+def shard_sources(graph, index, count):
+    # The discovered files of shard index out of count. A file's shard
+    # follows from its path below the base alone, so every machine picks
+    # the same files whatever the order or location of its checkout.
+    selected = []
+    for pathname in graph.index.sources:
+        relative = os.path.relpath(pathname, graph.index.base or os.curdir).replace(os.sep, '/')
+        if not isinstance(relative, bytes):
+            relative = relative.encode('utf-8')
+        if (zlib.crc32(relative) & 0xffffffff) % count == index:
+            selected.append(pathname)
+    return selected
+
+
+def iter_couplings(a_pathname, b_pathname, cache_dir=None, workers=1, graph=None, profiler=None, sources=None):
+    if graph is None:
+        graph = new_graph((a_pathname, b_pathname), profiler)
+    for module_pathname, names in iter_closures(graph, cache_dir, workers, profiler, sources):
+        dependencies = set()
+        for mod_name in names:
+            dependencies.add(module_meta(mod_name, graph.index.lookup(mod_name)))
+        yield module_meta(MAIN, module_pathname), dependencies
+
+
+def build_coupling(a_pathname, b_pathname, cache_dir=None, workers=1, graph=None, profiler=None):
+    if graph is None:
+        graph = new_graph((a_pathname, b_pathname), profiler)
+    return graph_coupling(graph, cache_dir, workers, profiler)
+
+
+def graph_coupling(graph, cache_dir=None, workers=1, profiler=None):
+    coupling = CouplingGraph()
+    ids = {}
+    for module_pathname, names in iter_closures(graph, cache_dir, workers, profiler):
+        target_ids = []
+        for mod_name in names:
+            i = ids.get(mod_name)
+            if i is None:
+                i = ids[mod_name] = coupling.intern(mod_name, graph.index.lookup(mod_name))
+            target_ids.append(i)
+        coupling.append(coupling.intern(MAIN, module_pathname), target_ids)
+    return coupling
+
+
+def save_builder(builder, profiler=None):
+    # Saves what the builder's parse cache and resolver learned and, with a
+    # profiler, counts their hits.
+    builder.cache.save()
+    builder.resolver.save()
+    if profiler is not None:
+        profiler.count('cache_hits', builder.cache.hits)
+        profiler.count('resolver_hits', builder.resolver.hits)
+        profiler.count('dirs_listed', builder.resolver.listed)
+
+
+def build_graph(graph, cache_dir=None, workers=1, profiler=None):
+    # Runs every discovered file as a script to fill in the import graph,
+    # without the closures iter_closures goes on to compute for each.
+    builder = GraphBuilder(graph, ParseCache(cache_dir), profiler, Resolver(cache_dir))
+    if workers > 1:
+        builder.preload(graph.index.sources, workers)
+    try:
+        for module_pathname in graph.index.sources:
+            builder.run_script(module_pathname)
+    finally:
+        save_builder(builder, profiler)
+    return graph
+
+
+def iter_closures(graph, cache_dir=None, workers=1, profiler=None, sources=None):
+    # Runs sources, by default every discovered file, as scripts.
+    modules = graph.index.sources if sources is None else sources
+    builder = GraphBuilder(graph, ParseCache(cache_dir), profiler, Resolver(cache_dir))
+    if workers > 1:
+        builder.preload(modules, workers)
+    try:
+        for module_pathname in modules:
+            # Everything the file reaches has been scanned once run_script
+            # returns, so its dependency set is final and can be handed out.
+            builder.run_script(module_pathname)
+            if profiler is None:
+                names = script_dependency_names(graph, module_pathname)
+            else:
+                start = clock()
+                names = script_dependency_names(graph, module_pathname)
+                profiler.since('aggregation', start)
+                if names:
+                    profiler.count('sources_emitted')
+                    profiler.count('edges_emitted', len(names))
+            if names:
+                yield module_pathname, names
+    finally:
+        save_builder(builder, profiler)
+
+
+def script_dependency_names(graph, module_pathname):
+    names = []
+    for mod_name in graph.script_closure(module_pathname):
+        pathname = graph.index.lookup(mod_name)
+        if pathname is not None and pathname != module_pathname:
+            names.append(mod_name)
+    return names
+
+
+def traverse_dependencies(modules, out, graph):
+    for module_pathname in modules:
+        names = script_dependency_names(graph, module_pathname)
+        if names:
+            out[module_meta(MAIN, module_pathname)] = set(
+                module_meta(mod_name, graph.index.lookup(mod_name)) for mod_name in names)
 
 if __name__ == '__main__':
-    path = sys.argv[1]
+    from decoupy.cli import run
+    sys.exit(run())
@@ -0,0 +1,52 @@
+from array import array
+
+from decoupy.main import new_graph, graph_coupling
+from decoupy.discovery import DEFAULT_EXCLUDES
+
+
+class CouplingMatrix(object):
+    # counts[i][j] is the number of (source file in roots[i], module in
+    # roots[j]) pairs where the source reaches the module, the same pairs
+    # main() reports for two roots. The pairs themselves are read back from
+    # the coupling table on demand.
+
+    def __init__(self, roots, coupling, root_ids):
+        self.roots = tuple(roots)
+        self.coupling = coupling
+        self.root_ids = root_ids
+        self.counts = [[0] * len(self.roots) for _ in self.roots]
+        for position, source_id in enumerate(coupling.sources):
+            row = self.counts[root_ids[source_id]]
+            for target_id in coupling.dependency_ids(position):
+                row[root_ids[target_id]] += 1
+
+    def iter_pairs(self):
+        # Yields (source root, target root, source, dependency) for every
+        # contributing pair in one pass over the table.
+        coupling = self.coupling
+        root_ids = self.root_ids
+        for position, source_id in enumerate(coupling.sources):
+            source = coupling.module(source_id)
+            for target_id in coupling.dependency_ids(position):
+                yield root_ids[source_id], root_ids[target_id], source, coupling.module(target_id)
+
+    def pairs(self, source_root, target_root):
+        return [(source, dependency) for i, j, source, dependency in self.iter_pairs()
+                if i == source_root and j == target_root]
+
+    def cells(self):
+        for i, row in enumerate(self.counts):
+            for j, count in enumerate(row):
+                if count:
+                    yield i, j, count
+
+
+def coupling_matrix(roots, cache_dir=None, workers=1, profiler=None, excludes=DEFAULT_EXCLUDES):
+    # All roots share one import graph, so every file is parsed and resolved
+    # once however many roots there are.
+    roots = tuple(roots)
+    graph = new_graph(roots, profiler, excludes)
+    coupling = graph_coupling(graph, cache_dir, workers, profiler)
+    # Every source and dependency in the table lies inside one of the roots.
+    root_ids = array('i', [graph.index.root_of(pathname) for pathname in coupling.pathnames])
+    return CouplingMatrix(roots, coupling, root_ids)
@@ -0,0 +1,74 @@
+import heapq
+import json
+from collections import OrderedDict
+from timeit import default_timer as clock
+
+PHASES = ('discovery', 'parsing', 'resolution', 'aggregation')
+COUNTERS = ('files_found', 'modules_parsed', 'cache_hits', 'external_modules', 'resolver_hits',
+            'dirs_listed', 'sources_emitted', 'edges_emitted')
+
+
+class Profiler(object):
+    # Collects per-phase wall time, counters and the slowest modules of a
+    # run. Code paths check `profiler is not None` before taking any timing,
+    # so a run without a profiler pays nothing. callback, when given, is
+    # called as callback(event, name, seconds) for every 'phase' increment
+    # and every timed 'module'.
+
+    def __init__(self, slowest=10, callback=None):
+        self.phases = OrderedDict((phase, 0.0) for phase in PHASES)
+        self.counters = OrderedDict((counter, 0) for counter in COUNTERS)
+        self.slowest_count = slowest
+        self.callback = callback
+        self._slowest = []
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] += seconds
+        if self.callback is not None:
+            self.callback('phase', phase, seconds)
+
+    def since(self, phase, start):
+        # Adds the time elapsed since start to phase and returns the current
+        # clock, so consecutive phases can be chained.
+        now = clock()
+        self.add_time(phase, now - start)
+        return now
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def module_time(self, pathname, seconds):
+        if len(self._slowest) < self.slowest_count:
+            heapq.heappush(self._slowest, (seconds, pathname))
+        elif self._slowest and seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, pathname))
+        if self.callback is not None:
+            self.callback('module', pathname, seconds)
+
+    def slowest(self):
+        return [(pathname, seconds) for seconds, pathname in sorted(self._slowest, reverse=True)]
+
+    def report(self):
+        return OrderedDict([
+            ('phases', self.phases),
+            ('total', sum(self.phases.values())),
+            ('counters', self.counters),
+            ('slowest', [OrderedDict([('pathname', pathname), ('seconds', seconds)])
+                         for pathname, seconds in self.slowest()]),
+        ])
+
+    def write_json(self, stream):
+        stream.write(json.dumps(self.report(), indent=2) + '\n')
+
+    def write_summary(self, stream):
+        total = sum(self.phases.values())
+        stream.write('phase          seconds      %\n')
+        for phase, seconds in self.phases.items():
+            stream.write('%-12s %9.3f %6.1f\n' % (phase, seconds, 100.0 * seconds / total if total else 0.0))
+        stream.write('%-12s %9.3f\n\n' % ('total', total))
+        for counter, value in self.counters.items():
+            stream.write('%-18s %d\n' % (counter, value))
+        if self._slowest:
+            stream.write('\nslowest modules\n')
+            for pathname, seconds in self.slowest():
+                stream.write('%9.4f  %s\n' % (seconds, pathname))
@@ -0,0 +1,139 @@
+import binascii
+from collections import deque
+
+from decoupy.graph import strongly_connected_components
+
+
+class ReachabilityIndex(object):
+    # Answers "does x depend on y" for an ImportGraph with one bit test.
+    # The graph is condensed to its strongly connected components, numbered
+    # sinks first, and every component gets a row of bits marking the
+    # components it reaches, itself included; rows are built from the rows
+    # of its successors, so each is one pass over the import edges.
+    # Components that import themselves are marked as cyclic, which is what
+    # makes a module depend on itself. The rows take n * n / 8 bytes for n
+    # components, one bytearray for the whole index.
+    #
+    # x may be a module name or a source file, which is then taken as the
+    # script the coupling is computed for; y may be a module name or the
+    # file of a module inside the roots.
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.component = {}
+        self.cyclic = []
+        rows = []
+        edges = graph.edges
+        for members in strongly_connected_components(edges):
+            c = len(rows)
+            for member in members:
+                self.component[member] = c
+            row = 1 << c
+            cyclic = len(members) > 1
+            for member in members:
+                for succ in edges[member]:
+                    s = self.component[succ]
+                    if s == c:
+                        cyclic = True
+                    else:
+                        row |= rows[s]
+            rows.append(row)
+            self.cyclic.append(cyclic)
+        self.row_size = (len(rows) + 7) // 8
+        self._bits = bytearray()
+        for row in rows:
+            self._bits.extend(_row_bytes(row, self.row_size))
+
+    def __len__(self):
+        return len(self.cyclic)
+
+    def module_name(self, name):
+        # Module names are taken as they are; a file inside the roots is
+        # mapped to the name of the module it defines.
+        if name in self.component:
+            return name
+        index = self.graph.index
+        local = index.local_path(name) if index is not None else None
+        if local is not None and index.name_for(local) in self.component:
+            return index.name_for(local)
+        raise KeyError('unknown module %r' % (name,))
+
+    def unreached(self, name):
+        # A module inside the roots that nothing imports is not in the graph
+        # at all; it is known, it just cannot be a dependency.
+        index = self.graph.index
+        if name in self.component or index is None:
+            return False
+        if name not in index.paths:
+            name = index.name_for(index.local_path(name) or name)
+        return name in index.paths and name not in self.component
+
+    def script(self, pathname):
+        index = self.graph.index
+        local = index.local_path(pathname) if index is not None else None
+        if local in self.graph.scripts:
+            return local
+        return None
+
+    def reaches(self, c, target):
+        # True when component c reaches component target, c itself included.
+        position = c * self.row_size + (target >> 3)
+        return bool(self._bits[position] >> (target & 7) & 1)
+
+    def depends_on(self, x, y):
+        if self.unreached(y):
+            return False
+        target_name = self.module_name(y)
+        target = self.component[target_name]
+        pathname = self.script(x)
+        if pathname is not None:
+            # Like the coupling result, a script does not depend on the
+            # module it is itself.
+            if target_name == self.graph.index.name_for(pathname):
+                return False
+            return any(self.reaches(self.component[name], target) for name in self.graph.scripts[pathname])
+        c = self.component[self.module_name(x)]
+        if c == target:
+            return self.cyclic[c]
+        return self.reaches(c, target)
+
+    def chain(self, x, y):
+        # The shortest import chain from x to y, both ends included, or None
+        # when x does not depend on y. The breadth-first search only enters
+        # modules that still reach y, so it never explores a dead end.
+        if not self.depends_on(x, y):
+            return None
+        y = self.module_name(y)
+        target = self.component[y]
+        pathname = self.script(x)
+        if pathname is not None:
+            start, successors = pathname, self.graph.scripts[pathname]
+        else:
+            start = self.module_name(x)
+            successors = self.graph.edges[start]
+        parents = {}
+        queue = deque()
+        for succ in sorted(successors):
+            if succ not in parents and self.reaches(self.component[succ], target):
+                parents[succ] = start
+                queue.append(succ)
+        while queue:
+            name = queue.popleft()
+            if name == y:
+                break
+            for succ in sorted(self.graph.edges[name]):
+                if succ not in parents and self.reaches(self.component[succ], target):
+                    parents[succ] = name
+                    queue.append(succ)
+        chain = [y]
+        while len(chain) == 1 or chain[-1] != start:
+            chain.append(parents[chain[-1]])
+        chain.reverse()
+        return chain
+
+
+def _row_bytes(row, size):
+    # Little-endian bytes of a non-negative int, so bit k is in byte k >> 3.
+    if not size:
+        return b''
+    return bytearray(reversed(bytearray(binascii.unhexlify('%0*x' % (size * 2, row)))))
@@ -0,0 +1,115 @@
+import os
+import sys
+
+from decoupy.cache import read_cache_file, write_cache_file
+
+try:
+    from importlib.machinery import all_suffixes
+except ImportError:
+    import imp
+
+    def all_suffixes():
+        return [suffix for suffix, mode, module_type in imp.get_suffixes()]
+
+RESOLVER_PREFIX = 'resolver-'
+INIT_FILE = '__init__.py'
+SUFFIXES = all_suffixes()
+
+
+class Resolver(object):
+    # Locates modules outside the roots the way find_module walks a search
+    # path, but answers from one listing per directory instead of a stat per
+    # candidate file, and remembers every answer, found or not, keyed by
+    # (name, search path). With a directory the state is persisted; listings
+    # are revalidated by the directory mtime on load and any change drops
+    # the remembered answers.
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.listings = {}
+        self.resolved = {}
+        self.hits = 0
+        self.listed = 0
+        self._dirty = False
+        if directory is not None:
+            self.load()
+
+    def load(self):
+        state = read_cache_file(self.directory, RESOLVER_PREFIX)
+        if not state:
+            return
+        listings, resolved = state
+        unchanged = True
+        for directory, (mtime, entries) in listings.items():
+            if directory_mtime(directory or os.curdir) == mtime:
+                self.listings[directory] = (mtime, entries)
+            else:
+                unchanged = False
+        if unchanged:
+            self.resolved = resolved
+        else:
+            self._dirty = True
+
+    def save(self):
+        if self.directory is None or not self._dirty:
+            return
+        write_cache_file(self.directory, RESOLVER_PREFIX, (self.listings, self.resolved))
+        self._dirty = False
+
+    def listing(self, directory):
+        # The names in directory, or None when it cannot be listed.
+        try:
+            return self.listings[directory][1]
+        except KeyError:
+            pass
+        mtime = directory_mtime(directory or os.curdir)
+        try:
+            entries = frozenset(os.listdir(directory or os.curdir))
+        except OSError:
+            entries = None
+        self.listed += 1
+        self.listings[directory] = (mtime, entries)
+        self._dirty = True
+        return entries
+
+    def find(self, partname, dirs, builtins=False):
+        # Returns (pathname, package search dirs) or None, like ModuleFinder.
+        key = (partname, tuple(dirs))
+        try:
+            found = self.resolved[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return found
+        found = self._find(partname, dirs, builtins)
+        self.resolved[key] = found
+        self._dirty = True
+        return found
+
+    def _find(self, partname, dirs, builtins):
+        if builtins and partname in sys.builtin_module_names:
+            return (None, None)
+        for directory in dirs:
+            entries = self.listing(directory)
+            if not entries:
+                continue
+            if partname in entries:
+                package_dir = os.path.join(directory, partname)
+                package_entries = self.listing(package_dir)
+                if package_entries and INIT_FILE in package_entries:
+                    return (os.path.join(package_dir, INIT_FILE), [package_dir])
+            for suffix in SUFFIXES:
+                # Only a name that is listed costs a stat, to tell a file
+                # from a directory with a module-like name.
+                pathname = os.path.join(directory, partname + suffix)
+                if partname + suffix in entries and os.path.isfile(pathname):
+                    return (pathname, None)
+        return None
+
+
+def directory_mtime(directory):
+    try:
+        return os.stat(directory).st_mtime
+    except OSError:
+        return None
@@ -0,0 +1,248 @@
+import os
+import sys
+import threading
+import subprocess
+
+from decoupy.cache import read_cache_file, write_cache_file
+from decoupy.discovery import DEFAULT_EXCLUDES, SOURCE_SUFFIX
+from decoupy.coupling import module_meta
+from decoupy.graph import GraphBuilder, ImportGraph, MAIN, strongly_connected_closures
+from decoupy.incremental import update_graph
+from decoupy.index import INIT_FILE, ModuleIndex
+from decoupy.main import base_path
+from decoupy.resolver import Resolver
+from decoupy.scanner import source_imports
+
+BLOB_PREFIX = 'blobs-'
+BLOB_MODES = ('100644', '100755')
+
+
+class RevisionError(Exception):
+    pass
+
+
+def git_toplevel(path):
+    directory = path if os.path.isdir(path) else os.path.dirname(path) or os.curdir
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=directory,
+                                       universal_newlines=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        raise RevisionError('%s is not inside a git work tree' % path)
+
+
+def tree_sources(toplevel, revision, roots):
+    # {pathname: blob id} of the source files under roots at revision, read
+    # from the object database. Pathnames are spelled under the root they
+    # belong to, as discovery would spell them in a checkout of revision.
+    prefixes = []
+    for root in roots:
+        relative = os.path.relpath(os.path.realpath(root), toplevel)
+        if relative == os.curdir:
+            prefixes.append(('', root))
+        else:
+            prefixes.append((relative.replace(os.sep, '/') + '/', root))
+    try:
+        listing = subprocess.check_output(
+            ['git', 'ls-tree', '-r', '-z', revision, '--'] + [prefix or '.' for prefix, root in prefixes],
+            cwd=toplevel, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError:
+        raise RevisionError('unknown revision %r' % revision)
+    sources = {}
+    for entry in listing.split(b'\0'):
+        if not entry:
+            continue
+        info, path = entry.split(b'\t', 1)
+        mode, kind, blob = info.decode('ascii').split()
+        if str is not bytes:
+            path = path.decode(sys.getfilesystemencoding(), 'surrogateescape')
+        if kind != 'blob' or mode not in BLOB_MODES or not path.endswith(SOURCE_SUFFIX):
+            continue
+        for prefix, root in prefixes:
+            if path.startswith(prefix):
+                sources[os.path.join(root, *path[len(prefix):].split('/'))] = blob
+                break
+    return sources
+
+
+def tree_base(toplevel, revision, roots):
+    # base_path as it would be in a checkout of revision: whether each
+    # directory from a root up to the top of the work tree is a package is
+    # read from the revision's tree, not from the files on disk.
+    inits = []
+    for root in roots:
+        path = os.path.realpath(root)
+        while path == toplevel or path.startswith(os.path.join(toplevel, '')):
+            inits.append(os.path.relpath(os.path.join(path, INIT_FILE), toplevel).replace(os.sep, '/'))
+            path = os.path.dirname(path)
+    try:
+        listing = subprocess.check_output(['git', 'ls-tree', '--name-only', '-z', revision, '--'] + inits,
+                                          cwd=toplevel, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError:
+        raise RevisionError('unknown revision %r' % revision)
+    present = set(name.decode(sys.getfilesystemencoding()) for name in listing.split(b'\0') if name)
+
+    def exists(pathname):
+        return os.path.relpath(os.path.realpath(pathname), toplevel).replace(os.sep, '/') in present
+
+    return base_path(roots, exists)
+
+
+def read_blobs(toplevel, blobs):
+    # Yields (blob id, contents) through one `git cat-file --batch`. The ids
+    # are written from a thread so a long list cannot fill both pipes.
+    process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=toplevel,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def write():
+        try:
+            process.stdin.write(''.join(blob + '\n' for blob in blobs).encode('ascii'))
+            process.stdin.close()
+        except (IOError, OSError):
+            # The reader gave up and closed its end.
+            pass
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for blob in blobs:
+            header = process.stdout.readline().split()
+            if len(header) != 3:
+                raise RevisionError('cannot read blob %s' % blob)
+            data = process.stdout.read(int(header[2]))
+            process.stdout.read(1)
+            yield blob, data
+    finally:
+        process.stdout.close()
+        writer.join()
+        process.wait()
+
+
+class BlobImports(object):
+    # Imports per blob id. A blob never changes, so unlike ParseCache the
+    # entries need no validation and files with identical contents, in
+    # either revision or anywhere in the tree, are parsed once.
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.entries = {}
+        self.parsed = 0
+        self._dirty = False
+        if directory is not None:
+            self.entries = read_cache_file(directory, BLOB_PREFIX) or {}
+
+    def save(self):
+        if self.directory is None or not self._dirty:
+            return
+        write_cache_file(self.directory, BLOB_PREFIX, self.entries)
+        self._dirty = False
+
+    def load(self, toplevel, sources, revision):
+        # Parses the blobs of sources that are not known yet.
+        missing = sorted(set(blob for blob in sources.values() if blob not in self.entries))
+        if not missing:
+            return
+        pathnames = dict((blob, pathname) for pathname, blob in sources.items())
+        for blob, data in read_blobs(toplevel, missing):
+            try:
+                self.entries[blob] = source_imports(data + b'\n', '%s:%s' % (revision, pathnames[blob]))
+            except (SyntaxError, TypeError, ValueError):
+                self.save()
+                raise
+            self.parsed += 1
+            self._dirty = True
+
+    def imports(self, sources):
+        return dict((pathname, self.entries[blob]) for pathname, blob in sources.items())
+
+
+def diff_revisions(old, new, roots, cache_dir=None, excludes=DEFAULT_EXCLUDES, cross=False):
+    # Coupling edges (source, dependency) added and removed between two
+    # revisions. The old revision is analyzed in full from its blobs, then
+    # only the files whose blob differs are applied to that graph, the way
+    # `update` applies edited files, and only the sources that update
+    # recomputes are compared. Module names follow the packages of each
+    # revision's tree; when those move the base, every module is renamed and
+    # the new revision is analyzed in full as well. With cross, edges within
+    # one root are left out.
+    roots = tuple(roots)
+    toplevel = git_toplevel(roots[0])
+    old_sources = tree_sources(toplevel, old, roots)
+    new_sources = tree_sources(toplevel, new, roots)
+    blobs = BlobImports(cache_dir)
+    resolver = Resolver(cache_dir)
+    try:
+        blobs.load(toplevel, old_sources, old)
+        changed = sorted(pathname for pathname in set(old_sources) | set(new_sources)
+                         if old_sources.get(pathname) != new_sources.get(pathname))
+        blobs.load(toplevel, dict((pathname, new_sources[pathname]) for pathname in changed
+                                  if pathname in new_sources), new)
+
+        old_base = tree_base(toplevel, old, roots)
+        new_base = tree_base(toplevel, new, roots)
+        graph = _revision_graph(old_base, roots, excludes, old_sources, blobs, resolver)
+        if new_base == old_base:
+            # Updating the graph replaces the import sets it changes but
+            # edits the edges of removed modules in place, so those are
+            # copied.
+            before = (dict((name, set(targets)) for name, targets in graph.edges.items()),
+                      dict(graph.scripts), dict(graph.index.paths), {})
+            builder = GraphBuilder(graph, resolver=resolver)
+            builder.add_parsed(blobs.imports(new_sources))
+            recompute = update_graph(builder, changed, new_sources.__contains__)
+        else:
+            before = (graph.edges, graph.scripts, graph.index.paths, {})
+            graph = _revision_graph(new_base, roots, excludes, new_sources, blobs, resolver)
+            recompute = sorted(set(old_sources) | set(new_sources))
+    finally:
+        blobs.save()
+        resolver.save()
+
+    after = (graph.edges, graph.scripts, graph.index.paths, {})
+    old_paths, new_paths = before[2], after[2]
+    moved = set(name for name in set(old_paths) | set(new_paths) if old_paths.get(name) != new_paths.get(name))
+    added = []
+    removed = []
+    for pathname in recompute:
+        # Compare the name sets first; only the names in their difference,
+        # and the ones whose file moved, can make an edge differ.
+        old_reached = _reached(before, pathname)
+        new_reached = _reached(after, pathname)
+        differ = (old_reached ^ new_reached) | (old_reached & new_reached & moved)
+        if not differ:
+            continue
+        source = module_meta(MAIN, pathname)
+        root = graph.index.root_of(pathname)
+        old_dependencies = _dependencies(differ & old_reached, old_paths, pathname)
+        new_dependencies = _dependencies(differ & new_reached, new_paths, pathname)
+        for edges, dependencies in ((added, new_dependencies - old_dependencies),
+                                    (removed, old_dependencies - new_dependencies)):
+            for dependency in dependencies:
+                if not cross or graph.index.root_of(dependency.pathname) != root:
+                    edges.append((source, dependency))
+    return sorted(added), sorted(removed)
+
+
+def _revision_graph(base, roots, excludes, sources, blobs, resolver):
+    graph = ImportGraph([base] + sys.path, ModuleIndex(base, roots, excludes, sorted(sources)))
+    builder = GraphBuilder(graph, resolver=resolver)
+    builder.add_parsed(blobs.imports(sources))
+    for pathname in graph.index.sources:
+        builder.run_script(pathname)
+    return graph
+
+
+def _reached(state, pathname):
+    edges, scripts, paths, closures = state
+    reached = set()
+    for target in scripts.get(pathname, ()):
+        if target not in closures:
+            strongly_connected_closures(edges, [target], closures)
+        reached.update(closures[target])
+    return reached
+
+
+def _dependencies(names, paths, pathname):
+    # Same rule as script_dependency_names: modules inside the roots other
+    # than the source itself.
+    return set(module_meta(name, paths[name]) for name in names
+               if paths.get(name) is not None and paths[name] != pathname)
@@ -0,0 +1,225 @@
+import re
+from collections import deque, namedtuple
+from fnmatch import fnmatchcase
+
+from decoupy.graph import strongly_connected_components
+from decoupy.index import dotted_name
+from decoupy.main import base_path
+
+RULE_KINDS = ('allow', 'forbid')
+RULE_LINE = re.compile(r'(\w+)\s+(\S+)\s*->\s*(\S+)\Z')
+
+rule = namedtuple('rule', 'kind source target line')
+violation = namedtuple('violation', 'rule source target chain')
+
+
+class RuleError(ValueError):
+    pass
+
+
+def parse_rules(lines, filename='<rules>'):
+    # One rule per line, `forbid SOURCE -> TARGET` or `allow SOURCE -> TARGET`,
+    # with glob patterns on dotted module names: `*` and `?` match within a
+    # name segment and `**` matches any number of segments, none included,
+    # so `pkg.**` is pkg and everything below it. Blank lines and lines
+    # starting with '#' are skipped.
+    rules = []
+    for number, text in enumerate(lines, 1):
+        text = text.strip()
+        if not text or text.startswith('#'):
+            continue
+        match = RULE_LINE.match(text)
+        if match is None or match.group(1) not in RULE_KINDS:
+            raise RuleError('%s:%d: expected "allow|forbid SOURCE -> TARGET"' % (filename, number))
+        for pattern in match.group(2, 3):
+            if '' in pattern.split('.'):
+                raise RuleError('%s:%d: empty name segment in %r' % (filename, number, pattern))
+        rules.append(rule(match.group(1), match.group(2), match.group(3), '%s:%d' % (filename, number)))
+    return rules
+
+
+def load_rules(pathname):
+    with open(pathname) as f:
+        return parse_rules(f, pathname)
+
+
+class _TrieNode(object):
+    __slots__ = ('literals', 'globs', 'deep', 'mask', 'loops')
+
+    def __init__(self, loops=False):
+        self.literals = {}
+        self.globs = []
+        self.deep = None
+        self.mask = 0
+        self.loops = loops
+
+
+class PatternTrie(object):
+    # Dotted-name patterns merged into one trie on name segments, with the
+    # pattern number as a bit in the mask of the node where it ends. A name
+    # is matched against every pattern at once by walking its segments with
+    # the set of trie nodes still alive, so the cost follows the shape of
+    # the patterns and not their number. Results are remembered per name.
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self._matches = {}
+
+    def add(self, pattern, bit):
+        node = self.root
+        for segment in pattern.split('.'):
+            if segment == '**':
+                if node.deep is None:
+                    node.deep = _TrieNode(loops=True)
+                node = node.deep
+            elif any(char in segment for char in '*?['):
+                for glob, child in node.globs:
+                    if glob == segment:
+                        node = child
+                        break
+                else:
+                    child = _TrieNode()
+                    node.globs.append((segment, child))
+                    node = child
+            else:
+                node = node.literals.setdefault(segment, _TrieNode())
+        node.mask |= 1 << bit
+        self._matches.clear()
+
+    def match(self, name):
+        try:
+            return self._matches[name]
+        except KeyError:
+            pass
+        states = self._expand([self.root])
+        for segment in name.split('.'):
+            following = []
+            for node in states:
+                if node.loops:
+                    following.append(node)
+                child = node.literals.get(segment)
+                if child is not None:
+                    following.append(child)
+                for glob, child in node.globs:
+                    if fnmatchcase(segment, glob):
+                        following.append(child)
+            states = self._expand(following)
+            if not states:
+                break
+        mask = 0
+        for node in states:
+            mask |= node.mask
+        self._matches[name] = mask
+        return mask
+
+    def _expand(self, nodes):
+        # A `**` also matches no segment at all.
+        seen = set()
+        states = []
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            states.append(node)
+            if node.deep is not None:
+                pending.append(node.deep)
+        return states
+
+
+class RuleSet(object):
+    # The last rule matching a (source, target) pair decides it, so an
+    # allow can carve an exception out of an earlier forbid. Rules apply to
+    # dependencies, not just direct imports: a source violates a forbid
+    # when any module it reaches through the import graph is forbidden.
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.sources = PatternTrie()
+        self.targets = PatternTrie()
+        self.forbidden = 0
+        for i, r in enumerate(self.rules):
+            self.sources.add(r.source, i)
+            self.targets.add(r.target, i)
+            if r.kind == 'forbid':
+                self.forbidden |= 1 << i
+
+    def reach_masks(self, edges):
+        # For every module the rules whose target pattern matches something
+        # it reaches, found in one pass over the strongly connected
+        # components, sinks first.
+        reach = {}
+        for members in strongly_connected_components(edges):
+            mask = 0
+            for member in members:
+                for succ in edges[member]:
+                    # Members of the same component have no entry yet, but
+                    # each of them is imported from inside it and so is
+                    # matched directly.
+                    mask |= self.targets.match(succ) | reach.get(succ, 0)
+            for member in members:
+                reach[member] = mask
+        return reach
+
+    def check(self, edges):
+        # Every source gets, for each rule it breaks, the shortest chain to
+        # the nearest module that breaks it. Only sources whose reach mask
+        # shares a forbid with their own mask are searched, and the search
+        # only enters modules that can still lead to one.
+        reach = self.reach_masks(edges)
+        violations = []
+        for source in sorted(edges):
+            source_mask = self.sources.match(source)
+            pending = source_mask & self.forbidden & reach[source]
+            if not pending:
+                continue
+            parents = {source: None}
+            queue = deque([source])
+            while queue and pending:
+                name = queue.popleft()
+                for succ in sorted(edges[name]):
+                    if succ in parents:
+                        continue
+                    parents[succ] = name
+                    mask = source_mask & self.targets.match(succ)
+                    if mask:
+                        bit = mask.bit_length() - 1
+                        if pending & (1 << bit) and self.forbidden & (1 << bit):
+                            pending &= ~(1 << bit)
+                            violations.append(violation(self.rules[bit], source, succ, _chain(parents, succ)))
+                    if reach[succ] & pending:
+                        queue.append(succ)
+        return violations
+
+
+def _chain(parents, name):
+    chain = []
+    while name is not None:
+        chain.append(name)
+        name = parents[name]
+    chain.reverse()
+    return chain
+
+
+def module_edges(graph):
+    # The import graph keyed by module name, including the modules inside
+    # the roots that nothing imports, which only appear as scripts.
+    edges = dict(graph.edges)
+    for pathname, targets in graph.scripts.items():
+        name = graph.index.name_for(pathname)
+        if name is not None and name not in edges:
+            edges[name] = targets
+    return edges
+
+
+def graph_file_edges(graph_file):
+    # Same as module_edges, for a graph file; the names of scripts nothing
+    # imports are derived from the roots the file was written for.
+    edges = graph_file.import_edges()
+    base = base_path(graph_file.roots)
+    for pathname, targets in graph_file.script_imports().items():
+        name = dotted_name(pathname, base)
+        if name is not None and name not in edges:
+            edges[name] = targets
+    return edges
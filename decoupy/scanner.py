@@ -0,0 +1,38 @@
+import ast
+import sys
+
+PY2 = sys.version_info[0] == 2
+
+
+def source_imports(source, pathname='<unknown>'):
+    tree = ast.parse(source, pathname)
+    implicit_level = -1 if PY2 and not _has_absolute_import(tree) else 0
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append((implicit_level, None, alias.name))
+        elif isinstance(node, ast.ImportFrom):
+            fromlist = tuple(alias.name for alias in node.names)
+            if node.level:
+                imports.append((node.level, fromlist, node.module or ''))
+            else:
+                imports.append((implicit_level, fromlist, node.module))
+    return imports
+
+
+def file_imports(pathname):
+    # Read as bytes so the parser decodes the file the way the interpreter
+    # does, honouring a coding cookie, instead of with the locale encoding.
+    with open(pathname, 'rb') as f:
+        return source_imports(f.read() + b'\n', pathname)
+
+
+def _has_absolute_import(tree):
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+            if any(alias.name == 'absolute_import' for alias in node.names):
+                return True
+        elif not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Str)):
+            return False
+    return False
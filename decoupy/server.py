@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import errno
+import select
+import socket
+
+from decoupy.cache import ParseCache
+from decoupy.client import query, read_line
+from decoupy.coupling import coupling_record
+from decoupy.discovery import DEFAULT_EXCLUDES, SOURCE_SUFFIX, discover
+from decoupy.graph import GraphBuilder, MAIN
+from decoupy.incremental import apply_changes
+from decoupy.main import new_graph, graph_coupling, module_meta
+from decoupy.reach import ReachabilityIndex
+from decoupy.resolver import Resolver
+from decoupy.watch import make_watcher
+
+REQUEST_TIMEOUT = 5.0
+
+
+class ServerError(Exception):
+    pass
+
+
+class CouplingServer(object):
+    # Keeps the graph and the result for a set of roots in memory, applies
+    # the watcher's changes incrementally and answers JSON requests, one per
+    # line and connection, on a Unix socket. Changes are picked up before
+    # every request, so an answer never lags behind what the watcher saw.
+
+    def __init__(self, roots, socket_path, cache_dir=None, excludes=DEFAULT_EXCLUDES, watch='auto',
+                 interval=1.0):
+        self.roots = tuple(roots)
+        self.socket_path = socket_path
+        self.cache_dir = cache_dir
+        self.excludes = excludes
+        self.watcher = make_watcher(watch, self.roots, excludes, interval)
+        self.generation = 0
+        self.error = None
+        self.running = False
+        self._socket = None
+        self._reach = None
+        self.rebuild()
+
+    def rebuild(self):
+        self.graph = new_graph(self.roots, excludes=self.excludes)
+        try:
+            self.out = graph_coupling(self.graph, self.cache_dir).to_dict()
+        except (SyntaxError, ValueError, TypeError, IOError, OSError) as e:
+            self.out = {}
+            self.error = '%s: %s' % (type(e).__name__, e)
+        else:
+            self.error = None
+        # The full build saved its own caches; start from what it wrote.
+        self.cache = ParseCache(self.cache_dir)
+        self.resolver = Resolver(self.cache_dir)
+        self.generation += 1
+        self.updated = time.time()
+
+    def apply(self, changed_paths):
+        if not changed_paths:
+            return []
+        if self.error is not None:
+            # The last update left the graph half-applied, so start over.
+            self.rebuild()
+            return sorted(self.graph.scripts)
+        builder = GraphBuilder(self.graph, self.cache, resolver=self.resolver)
+        try:
+            recomputed = apply_changes(builder, self.out, self.expand(changed_paths))
+        except (SyntaxError, ValueError, TypeError, IOError, OSError) as e:
+            self.error = '%s: %s' % (type(e).__name__, e)
+            recomputed = []
+        self.cache.save()
+        self.resolver.save()
+        self.generation += 1
+        self.updated = time.time()
+        return recomputed
+
+    def expand(self, changed_paths):
+        # Watchers may report a directory; everything known or discoverable
+        # below it may have changed.
+        expanded = set()
+        for pathname in changed_paths:
+            if pathname.endswith(SOURCE_SUFFIX):
+                expanded.add(pathname)
+                continue
+            prefix = os.path.join(os.path.abspath(pathname), '')
+            expanded.update(source for source in self.graph.index.sources
+                            if os.path.abspath(source).startswith(prefix))
+            expanded.update(discover([pathname], self.excludes))
+        return sorted(expanded)
+
+    def refresh(self, force=False):
+        return self.apply(self.watcher.changes(force))
+
+    def handle(self, request):
+        command = request.get('command')
+        self.refresh(command == 'refresh')
+        if command == 'ping':
+            return {}
+        if command == 'status':
+            return {
+                'roots': list(self.roots),
+                'sources': len(self.graph.index.sources),
+                'modules': len(self.graph.files),
+                'generation': self.generation,
+                'updated': self.updated,
+                'error': self.error,
+            }
+        if command == 'refresh':
+            return {'generation': self.generation}
+        if command == 'shutdown':
+            self.running = False
+            return {}
+        if self.error is not None:
+            raise ServerError('analysis failed: %s' % self.error)
+        if command == 'coupling':
+            if request.get('pathname') is not None:
+                source = module_meta(MAIN, self.graph.index.local_path(request['pathname']))
+                sources = [source] if source in self.out else []
+            else:
+                sources = sorted(self.out)
+            return {'records': [coupling_record(source, self.out[source]) for source in sources]}
+        if command == 'dependents':
+            package = request.get('package')
+            return {'sources': sorted(source.pathname for source, dependencies in self.out.items()
+                                      if any(dependency.package == package for dependency in dependencies))}
+        if command == 'why':
+            try:
+                chain = self.reachability().chain(request.get('source'), request.get('target'))
+            except KeyError as e:
+                raise ServerError(e.args[0])
+            return {'depends': chain is not None, 'chain': chain}
+        raise ServerError('unknown command %r' % (command,))
+
+    def reachability(self):
+        # Built on the first question after a change and kept until the next.
+        if self._reach is None or self._reach[0] != self.generation:
+            self._reach = (self.generation, ReachabilityIndex(self.graph))
+        return self._reach[1]
+
+    def respond(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ServerError('a request must be a JSON object')
+            response = self.handle(request)
+            response['ok'] = True
+        except (ServerError, ValueError) as e:
+            response = {'ok': False, 'error': str(e)}
+        return (json.dumps(response, sort_keys=True) + '\n').encode('utf-8')
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            try:
+                query(self.socket_path, {'command': 'ping'})
+            except socket.error:
+                os.remove(self.socket_path)
+            else:
+                raise ServerError('a server is already listening on %s' % self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        self._socket.listen(16)
+
+    def serve_forever(self):
+        if self._socket is None:
+            self.bind()
+        self.running = True
+        try:
+            while self.running:
+                readable = [self._socket]
+                if self.watcher.fileno() is not None:
+                    readable.append(self.watcher.fileno())
+                try:
+                    ready = select.select(readable, [], [], self.watcher.timeout())[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if self._socket in ready:
+                    self.serve_one()
+                else:
+                    self.refresh()
+        finally:
+            self.close()
+
+    def serve_one(self):
+        connection = self._socket.accept()[0]
+        connection.settimeout(REQUEST_TIMEOUT)
+        try:
+            connection.sendall(self.respond(read_line(connection)))
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    def close(self):
+        self.watcher.close()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def serve(roots, socket_path, cache_dir=None, excludes=DEFAULT_EXCLUDES, watch='auto', interval=1.0):
+    server = CouplingServer(roots, socket_path, cache_dir, excludes, watch, interval)
+    sys.stderr.write('decoupy: serving %s on %s\n' % (', '.join(server.roots), socket_path))
+    server.serve_forever()
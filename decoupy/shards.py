@@ -0,0 +1,65 @@
+import heapq
+
+from decoupy.coupling import CouplingGraph
+from decoupy.graph import ImportGraph
+from decoupy.graphfile import GraphFile, write_graph_file
+
+
+class MergeError(Exception):
+    pass
+
+
+def merge_graph_files(pathnames, output=None):
+    # Combines the graph files written by every shard of one scan into the
+    # result of an unsharded scan, in its order: every shard records the
+    # discovery position of its sources, so the parts are merged on it.
+    # With output the merged graph file is written there.
+    parts = [GraphFile(pathname) for pathname in pathnames]
+    try:
+        check_parts(parts)
+        coupling = CouplingGraph()
+        positions = []
+        for position, k, i in heapq.merge(*[_positions(k, part) for k, part in enumerate(parts)]):
+            part = parts[k]
+            coupling.append(coupling.intern(*part.module(part.sources[i])),
+                            [coupling.intern(*part.module(target)) for target in part.dependency_ids(i)])
+            positions.append(position)
+        if output is not None:
+            # Every shard scanned what its sources reach, and a module's
+            # imports do not depend on who reached it, so the union of the
+            # partial graphs is the graph of the whole scan.
+            graph = ImportGraph()
+            for part in parts:
+                graph.files.update(part.import_files())
+                graph.edges.update(part.import_edges())
+                graph.scripts.update(part.script_imports())
+            write_graph_file(output, coupling, graph, parts[0].roots, positions=positions)
+        return coupling
+    finally:
+        for part in parts:
+            part.close()
+
+
+def _positions(k, part):
+    for i, position in enumerate(part.positions):
+        yield position, k, i
+
+
+def check_parts(parts):
+    if not parts:
+        raise MergeError('nothing to merge')
+    roots = parts[0].roots
+    count = parts[0].shard_count
+    shards = {}
+    for part in parts:
+        if part.roots != roots:
+            raise MergeError('%s is a shard of a scan of other roots' % part.pathname)
+        if part.shard_count != count:
+            raise MergeError('%s is one of %d shards, not %d' % (part.pathname, part.shard_count, count))
+        if part.shard_index in shards:
+            raise MergeError('%s and %s are both shard %d/%d' % (shards[part.shard_index], part.pathname,
+                                                                 part.shard_index + 1, count))
+        shards[part.shard_index] = part.pathname
+    missing = sorted(set(range(count)) - set(shards))
+    if missing:
+        raise MergeError('shards %s of %d are missing' % (', '.join(str(i + 1) for i in missing), count))
@@ -0,0 +1,32 @@
+import pickle
+
+SNAPSHOT_VERSION = 3
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def save_snapshot(pathname, a_pathname, b_pathname, graph, coupling):
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'roots': (a_pathname, b_pathname),
+        'graph': graph,
+        'result': coupling,
+    }
+    with open(pathname, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_snapshot(pathname):
+    with open(pathname, 'rb') as f:
+        try:
+            state = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, IndexError,
+                KeyError, TypeError):
+            raise SnapshotError('%s is not a decoupy snapshot' % pathname)
+    if not isinstance(state, dict):
+        raise SnapshotError('%s is not a decoupy snapshot' % pathname)
+    if state.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError('%s was written by an incompatible decoupy version' % pathname)
+    return state
@@ -0,0 +1,203 @@
+import os
+import struct
+import sqlite3
+
+from decoupy.cache import ParseCache
+from decoupy.coupling import module_meta
+from decoupy.discovery import DEFAULT_EXCLUDES
+from decoupy.graph import GraphBuilder, MAIN
+from decoupy.main import new_graph, save_builder
+from decoupy.profiling import clock
+from decoupy.resolver import Resolver
+
+BATCH_SIZE = 10000
+# Stored as the database's application_id, so that a spill database can be
+# told apart from any other file at the same path before it is replaced.
+APPLICATION_ID = 0x44435059
+SQLITE_MAGIC = b'SQLite format 3\0'
+SCHEMA = '''
+CREATE TABLE modules (id INTEGER PRIMARY KEY, name TEXT NOT NULL, pathname TEXT);
+CREATE TABLE edges (source INTEGER NOT NULL, target INTEGER NOT NULL,
+                    PRIMARY KEY (source, target)) WITHOUT ROWID;
+CREATE TABLE scripts (id INTEGER PRIMARY KEY, pathname TEXT NOT NULL);
+CREATE TABLE script_edges (script INTEGER NOT NULL, target INTEGER NOT NULL,
+                           PRIMARY KEY (script, target)) WITHOUT ROWID;
+CREATE TABLE coupling (script INTEGER NOT NULL, target INTEGER NOT NULL,
+                       PRIMARY KEY (script, target)) WITHOUT ROWID;
+'''
+# Everything a script reaches through the import graph, less what lies
+# outside the roots and the script itself, as script_dependency_names.
+COUPLING_QUERY = '''
+WITH RECURSIVE reach(id) AS (
+    SELECT target FROM script_edges WHERE script = ?
+    UNION
+    SELECT edges.target FROM edges JOIN reach ON edges.source = reach.id
+)
+INSERT INTO coupling
+SELECT ?, modules.id FROM reach JOIN modules ON modules.id = reach.id
+WHERE modules.pathname IS NOT NULL AND modules.pathname != ?
+'''
+RESULTS_QUERY = '''
+SELECT scripts.pathname, modules.name, modules.pathname
+FROM coupling JOIN scripts ON scripts.id = coupling.script JOIN modules ON modules.id = coupling.target
+ORDER BY coupling.script
+'''
+
+
+class StorageError(Exception):
+    pass
+
+
+def is_spill_database(pathname):
+    # Reads the header rather than opening the file with sqlite3, which
+    # would accept any file and only fail on the first query.
+    with open(pathname, 'rb') as f:
+        header = f.read(100)
+    return (len(header) == 100 and header.startswith(SQLITE_MAGIC)
+            and struct.unpack('>I', header[68:72])[0] == APPLICATION_ID)
+
+
+class SqliteStore(object):
+    # Modules, import edges, the scripts' imports and the result in an
+    # SQLite database, written in batches of BATCH_SIZE rows per
+    # transaction. Of those, the store itself keeps only the module name to
+    # id map in memory; see spilled_couplings for what the rest of a run
+    # keeps.
+
+    def __init__(self, pathname):
+        if os.path.exists(pathname):
+            if os.path.isdir(pathname) or not is_spill_database(pathname):
+                raise StorageError('%s exists and is not a decoupy spill database' % pathname)
+            os.remove(pathname)
+        self.connection = sqlite3.connect(pathname)
+        self.connection.execute('PRAGMA application_id = %d' % APPLICATION_ID)
+        # The database is rebuilt by every run, so a crash costs nothing that
+        # a journal or an fsync could save.
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.executescript(SCHEMA)
+        self.ids = {}
+        self.script_count = 0
+        self._modules = []
+        self._edges = []
+        self._scripts = []
+        self._script_edges = []
+
+    def module_id(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            i = self.ids[name] = len(self.ids) + 1
+            return i
+
+    def add_module(self, name, pathname):
+        self._modules.append((self.module_id(name), name, pathname))
+        self._maybe_flush()
+
+    def add_edges(self, name, targets):
+        source = self.module_id(name)
+        self._edges.extend((source, self.module_id(target)) for target in targets)
+        self._maybe_flush()
+
+    def add_script(self, pathname, targets):
+        self.script_count += 1
+        self._scripts.append((self.script_count, pathname))
+        self._script_edges.extend((self.script_count, self.module_id(target)) for target in targets)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._modules) + len(self._edges) + len(self._scripts) + len(self._script_edges) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany('INSERT INTO modules VALUES (?, ?, ?)', self._modules)
+            self.connection.executemany('INSERT OR IGNORE INTO edges VALUES (?, ?)', self._edges)
+            self.connection.executemany('INSERT INTO scripts VALUES (?, ?)', self._scripts)
+            self.connection.executemany('INSERT OR IGNORE INTO script_edges VALUES (?, ?)', self._script_edges)
+        del self._modules[:], self._edges[:], self._scripts[:], self._script_edges[:]
+
+    def compute_coupling(self):
+        # One recursive query per script, committed in chunks of scripts; the
+        # result never passes through Python.
+        self.flush()
+        chunk = BATCH_SIZE // 10
+        for first in range(1, self.script_count + 1, chunk):
+            with self.connection:
+                scripts = self.connection.execute('SELECT id, pathname FROM scripts WHERE id BETWEEN ? AND ?',
+                                                  (first, first + chunk - 1)).fetchall()
+                for script, pathname in scripts:
+                    self.connection.execute(COUPLING_QUERY, (script, script, pathname))
+
+    def iter_coupling(self):
+        # Yields (source, dependencies) in discovery order, holding one
+        # source's dependencies at a time.
+        current = None
+        dependencies = set()
+        for pathname, name, dependency_pathname in self.connection.execute(RESULTS_QUERY):
+            if pathname != current:
+                if current is not None:
+                    yield module_meta(MAIN, current), dependencies
+                current = pathname
+                dependencies = set()
+            dependencies.add(module_meta(name, dependency_pathname))
+        if current is not None:
+            yield module_meta(MAIN, current), dependencies
+
+    def close(self):
+        self.connection.close()
+
+
+class SpillGraph(object):
+    # Takes the place of ImportGraph for GraphBuilder and passes what it is
+    # told on to the store. Only the names of the modules seen are kept;
+    # misses are dropped, as there is no incremental update to use them.
+
+    def __init__(self, path, index, store):
+        self.path = path
+        self.index = index
+        self.store = store
+        self.files = set()
+
+    def add_module(self, name, pathname):
+        self.files.add(name)
+        self.store.add_module(name, self.index.lookup(name))
+
+    def set_imports(self, name, targets, misses=()):
+        self.store.add_edges(name, targets)
+
+    def add_script(self, pathname, targets, misses=()):
+        self.store.add_script(pathname, targets)
+
+
+def spilled_couplings(roots, database, cache_dir=None, profiler=None, excludes=DEFAULT_EXCLUDES, workers=1):
+    # Yields what iter_couplings yields, in the same order, with the graph
+    # and the result kept in the database at pathname database instead of
+    # in memory. What stays in memory grows with the number of files, not
+    # with the edges or the result: module names, the parsed imports of
+    # each file and one source's dependencies at a time. An existing file
+    # at database is only replaced when it is an earlier spill database.
+    graph = new_graph(roots, profiler, excludes)
+    store = SqliteStore(database)
+    try:
+        builder = GraphBuilder(SpillGraph(graph.path, graph.index, store), ParseCache(cache_dir), profiler,
+                               Resolver(cache_dir))
+        if workers > 1:
+            builder.preload(graph.index.sources, workers)
+        try:
+            for pathname in graph.index.sources:
+                builder.run_script(pathname)
+        finally:
+            save_builder(builder, profiler)
+        if profiler is not None:
+            start = clock()
+        store.compute_coupling()
+        if profiler is not None:
+            profiler.since('aggregation', start)
+        for source, dependencies in store.iter_coupling():
+            if profiler is not None:
+                profiler.count('sources_emitted')
+                profiler.count('edges_emitted', len(dependencies))
+            yield source, dependencies
+    finally:
+        store.close()
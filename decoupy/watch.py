@@ -0,0 +1,170 @@
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+from decoupy.discovery import DEFAULT_EXCLUDES, SOURCE_SUFFIX, ExcludeRules, discover
+from decoupy.profiling import clock
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+
+
+class PollingWatcher(object):
+    # Re-walks the roots every interval seconds and reports the source files
+    # whose (mtime, size) changed, appeared or disappeared.
+
+    def __init__(self, roots, excludes=DEFAULT_EXCLUDES, interval=1.0):
+        self.roots = tuple(roots)
+        self.excludes = ExcludeRules(excludes)
+        self.interval = interval
+        self._stamps = self._scan()
+        self._next = clock() + interval
+
+    def fileno(self):
+        return None
+
+    def timeout(self):
+        return max(0.0, self._next - clock())
+
+    def changes(self, force=False):
+        if not force and clock() < self._next:
+            return []
+        self._next = clock() + self.interval
+        stamps = self._scan()
+        changed = [pathname for pathname in set(stamps) | set(self._stamps)
+                   if stamps.get(pathname) != self._stamps.get(pathname)]
+        self._stamps = stamps
+        return sorted(changed)
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        stamps = {}
+        for pathname in discover(self.roots, self.excludes):
+            try:
+                st = os.stat(pathname)
+            except OSError:
+                continue
+            stamps[pathname] = (st.st_mtime, st.st_size)
+        return stamps
+
+
+class InotifyWatcher(object):
+    # Watches every directory under the roots with inotify through libc.
+    # Changed source files are reported by path; a directory that appeared,
+    # disappeared or was moved is reported as the directory itself, as is a
+    # root when the kernel queue overflowed, and the caller re-examines
+    # everything below it.
+
+    def __init__(self, roots, excludes=DEFAULT_EXCLUDES):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.roots = tuple(roots)
+        self.excludes = ExcludeRules(excludes)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._dirs = {}
+        for root in self.roots:
+            self._watch_tree(root, '')
+
+    def fileno(self):
+        return self._fd
+
+    def timeout(self):
+        return None
+
+    def changes(self, force=False):
+        changed = set()
+        for wd, mask, name in self._read_events():
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.roots)
+                continue
+            if wd not in self._dirs:
+                continue
+            directory, relative = self._dirs[wd]
+            pathname = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(pathname, relative + name + '/')
+                changed.add(pathname)
+            elif name.endswith(SOURCE_SUFFIX):
+                changed.add(pathname)
+        return sorted(changed)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _watch_tree(self, top, relative):
+        pending = [(top, relative)]
+        while pending:
+            directory, relative = pending.pop()
+            if relative and self.excludes.match(relative.rstrip('/'), True):
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, fs_bytes(directory), WATCH_MASK)
+            if wd < 0:
+                continue
+            self._dirs[wd] = (directory, relative)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                pathname = os.path.join(directory, name)
+                if os.path.isdir(pathname) and not os.path.islink(pathname):
+                    pending.append((pathname, relative + name + '/'))
+
+    def _read_events(self):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            if str is not bytes:
+                name = name.decode(sys.getfilesystemencoding())
+            offset += length
+            yield wd, mask, name
+
+
+def fs_bytes(pathname):
+    if isinstance(pathname, bytes):
+        return pathname
+    return pathname.encode(sys.getfilesystemencoding())
+
+
+def make_watcher(kind, roots, excludes=DEFAULT_EXCLUDES, interval=1.0):
+    if kind in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(roots, excludes)
+        except (OSError, AttributeError):
+            if kind == 'inotify':
+                raise
+    return PollingWatcher(roots, excludes, interval)
@@ -1,8 +1,36 @@
 import os
 import shutil
 from unittest import TestCase
-from decoupy.main import main, module_meta, find_common_base_path
+from decoupy.main import main, module_meta, find_common_base_path, iter_couplings, new_graph, graph_coupling
+from decoupy.main import build_graph
+from decoupy.cli import run
+from decoupy.coupling import CouplingGraph
+from decoupy.profiling import Profiler
+from decoupy.matrix import coupling_matrix
+from decoupy.discovery import ExcludeRules, discover
+from decoupy.resolver import Resolver
+from decoupy.server import CouplingServer, query
+from decoupy.reach import ReachabilityIndex
+from decoupy.graphfile import GraphFile
+from decoupy.snapshot import SnapshotError
+from decoupy.revisions import diff_revisions
+from decoupy.storage import spilled_couplings
+from decoupy.shards import MergeError, merge_graph_files
+from decoupy.rules import PatternTrie, RuleError, RuleSet, module_edges, parse_rules
+import sys
+import socket
+import threading
+import subprocess
+from benchmarks.tree import generate_tree
+from decoupy.graph import strongly_connected_closures
+from decoupy.cache import ParseCache, cache_tag
+from decoupy.incremental import update
+from decoupy.index import ModuleIndex, dotted_name
+from decoupy.scanner import source_imports, file_imports
 from tempfile import gettempdir
+from StringIO import StringIO
+import json
+import pickle
 import mock
 
 
@@ -120,6 +148,21 @@ class UnitTests(TestCase):
         common_path = find_common_base_path(path1, path2)
         self.assertEqual(common_path, os.path.join(ROOT_PACKAGE, "common_folder1", "common_folder2"))
 
+    def test_closures_share_cycle_members(self):
+        edges = {
+            'a': set(['b']),
+            'b': set(['c']),
+            'c': set(['b', 'd']),
+            'd': set(),
+            'e': set(['a']),
+        }
+        closures = strongly_connected_closures(edges)
+        self.assertEqual(closures['a'], frozenset('abcd'))
+        self.assertEqual(closures['b'], frozenset('bcd'))
+        self.assertIs(closures['b'], closures['c'])
+        self.assertEqual(closures['d'], frozenset('d'))
+        self.assertEqual(closures['e'], frozenset('abcde'))
+
 
 
 class AcceptanceTests(TestCase):
@@ -188,6 +231,70 @@ class AcceptanceTests(TestCase):
         }
         self.assertDictEqual(result, etalon)
 
+    def test_relative_imports_in_scripts(self):
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: 'from . import module_b',
+                        MODULE_A: """
+                                    from . import module_b
+                                    from ..package_b import module_a
+                                  """,
+                        MODULE_B: 'import os',
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                    }
+                }
+            }
+        )
+
+        result = main(PACKAGE_A_PATHNAME, PACKAGE_B_PATHNAME)
+
+        package_a = module_meta('.'.join([ROOT, PACKAGE_A]), PACKAGE_A_MODULE_INIT_PATHNAME)
+        package_a_module_b = module_meta('.'.join([ROOT, PACKAGE_A, 'module_b']), PACKAGE_A_MODULE_B_PATHNAME)
+        etalon = {
+            module_meta(MAIN, PACKAGE_A_MODULE_A_PATHNAME): set(
+                [package_a, package_a_module_b,
+                 module_meta('.'.join([ROOT, PACKAGE_B]), PACKAGE_B_MODULE_INIT_PATHNAME),
+                 module_meta('.'.join([ROOT, PACKAGE_B, 'module_a']), PACKAGE_B_MODULE_A_PATHNAME)]
+            ),
+            module_meta(MAIN, PACKAGE_A_MODULE_INIT_PATHNAME): set([package_a_module_b]),
+        }
+        self.assertDictEqual(result, etalon)
+
+    def test_source_in_an_import_cycle_is_keyed_as_main(self):
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_a import module_a',
+                    }
+                }
+            }
+        )
+
+        result = main(PACKAGE_A_PATHNAME, PACKAGE_B_PATHNAME)
+
+        package_a = module_meta('.'.join([ROOT, PACKAGE_A]), PACKAGE_A_MODULE_INIT_PATHNAME)
+        package_a_module_a = module_meta('.'.join([ROOT, PACKAGE_A, 'module_a']), PACKAGE_A_MODULE_A_PATHNAME)
+        package_b = module_meta('.'.join([ROOT, PACKAGE_B]), PACKAGE_B_MODULE_INIT_PATHNAME)
+        package_b_module_a = module_meta('.'.join([ROOT, PACKAGE_B, 'module_a']), PACKAGE_B_MODULE_A_PATHNAME)
+        etalon = {
+            module_meta(MAIN, PACKAGE_A_MODULE_A_PATHNAME): set([package_a, package_b, package_b_module_a]),
+            module_meta(MAIN, PACKAGE_B_MODULE_A_PATHNAME): set([package_a, package_a_module_a, package_b]),
+        }
+        self.assertDictEqual(result, etalon)
+
     def test_two_dependencies_and_custom_modules_straight(self):
         build_package_tree(
             {
@@ -311,6 +418,64 @@ class AcceptanceTests(TestCase):
 
         self.assertDictEqual(result, etalon)
 
+    def test_parallel_parsing_matches_serial(self):
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import shutil'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_a import module_b',
+                        MODULE_B: 'import root_package.package_a'
+                    }
+                }
+            }
+        )
+
+        serial = main(PACKAGE_A_PATHNAME, PACKAGE_B_PATHNAME)
+        parallel = main(PACKAGE_A_PATHNAME, PACKAGE_B_PATHNAME, workers=2)
+
+        self.assertDictEqual(parallel, serial)
+
+    def test_sibling_with_common_prefix_is_not_inside(self):
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: """
+                                    from root_package.package_a_old import module_a
+                                    from root_package.package_b import module_b
+                                  """
+                    },
+                    PACKAGE_A + '_old': {
+                        INIT_FILE: '',
+                        MODULE_A: ''
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_B: ''
+                    }
+                }
+            }
+        )
+
+        result = main(PACKAGE_A_PATHNAME, PACKAGE_B_PATHNAME)
+
+        etalon = {
+            module_meta(MAIN, PACKAGE_A_MODULE_A_PATHNAME): set(
+                [module_meta('.'.join([ROOT, PACKAGE_B]), PACKAGE_B_MODULE_INIT_PATHNAME),
+                 module_meta('.'.join([ROOT, PACKAGE_B, "module_b"]), PACKAGE_B_MODULE_B_PATHNAME)]
+            ),
+        }
+        self.assertDictEqual(result, etalon)
+
     def test_dependency_from_init_module(self):
         build_package_tree(
             {
@@ -489,3 +654,1018 @@ class AcceptanceTests(TestCase):
         }
 
         self.assertDictEqual(result, etalon)
+
+
+class ParseCacheTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.cache_dir = os.path.join(gettempdir(), 'decoupy_cache')
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: """
+                                    import os
+                                    from root_package.package_b import module_a
+                                  """
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_warm_run_does_not_parse(self):
+        package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        cold = main(package_a, package_b, cache_dir=self.cache_dir)
+        with mock.patch('decoupy.graph.file_imports') as parse_stub:
+            warm = main(package_a, package_b, cache_dir=self.cache_dir)
+        self.assertFalse(parse_stub.called)
+        self.assertDictEqual(cold, warm)
+
+    def test_hit_rate(self):
+        pathname = os.path.join(ROOT_PACKAGE, PACKAGE_B, MODULE_A)
+        cache = ParseCache(self.cache_dir)
+        self.assertIsNone(cache.get(pathname))
+        cache.put(pathname, [(0, None, 'socket')])
+        cache.save()
+        cache = ParseCache(self.cache_dir)
+        self.assertEqual(cache.get(pathname), [(0, None, 'socket')])
+        self.assertEqual(cache.hit_rate, 1.0)
+
+    def test_changed_file_is_a_miss(self):
+        pathname = os.path.join(ROOT_PACKAGE, PACKAGE_B, MODULE_A)
+        cache = ParseCache()
+        cache.put(pathname, [(0, None, 'socket')])
+        make_file(pathname, 'import shutil, os')
+        self.assertIsNone(cache.get(pathname))
+
+    def test_stale_versions_are_dropped(self):
+        os.makedirs(self.cache_dir)
+        stale = os.path.join(self.cache_dir, 'imports-cpython00-0.0.0')
+        make_file(stale, '')
+        cache = ParseCache(self.cache_dir)
+        cache.put(os.path.join(ROOT_PACKAGE, PACKAGE_B, MODULE_A), [])
+        cache.save()
+        self.assertEqual(os.listdir(self.cache_dir), [cache_tag()])
+
+
+class IncrementalTests(TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.snapshot = os.path.join(gettempdir(), 'decoupy.snapshot')
+        self.cache_dir = os.path.join(gettempdir(), 'decoupy_cache')
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_a import module_b',
+                        MODULE_B: 'import os'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                        MODULE_B: 'from root_package.package_a import module_a'
+                    }
+                }
+            }
+        )
+        main(self.package_a, self.package_b, cache_dir=self.cache_dir, snapshot=self.snapshot)
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+        shutil.rmtree(self.cache_dir)
+        os.remove(self.snapshot)
+
+    def test_changed_dependency_propagates_to_importers(self):
+        changed = os.path.join(self.package_a, MODULE_B)
+        make_file(changed, 'from root_package.package_b import module_a')
+        with mock.patch('decoupy.graph.file_imports', side_effect=file_imports) as parse_stub:
+            result = update(self.snapshot, [changed], cache_dir=self.cache_dir)
+        self.assertEqual(parse_stub.call_count, 1)
+        self.assertDictEqual(result, main(self.package_a, self.package_b))
+
+    def test_unreadable_snapshot(self):
+        with open(self.snapshot, 'wb') as f:
+            f.write(b'not a snapshot')
+        missing = os.path.join(gettempdir(), 'decoupy_missing.snapshot')
+        for snapshot, message in ((self.snapshot, 'is not a decoupy snapshot'),
+                                  (missing, 'No such file or directory')):
+            stderr = StringIO()
+            with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', stderr):
+                self.assertEqual(run(['update', snapshot]), 2)
+            self.assertIn(message, stderr.getvalue())
+
+    def test_added_and_removed_files(self):
+        added = os.path.join(self.package_b, 'module_c.py')
+        make_file(added, 'from root_package.package_a import module_a')
+        removed = os.path.join(self.package_a, MODULE_B)
+        os.remove(removed)
+        result = update(self.snapshot, [added, removed])
+        self.assertDictEqual(result, main(self.package_a, self.package_b))
+        self.assertIn(module_meta(MAIN, added), result)
+
+
+class StreamingTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                        MODULE_B: 'from root_package.package_a import module_b'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_records_are_produced_before_the_whole_tree_is_parsed(self):
+        with mock.patch('decoupy.graph.file_imports', side_effect=file_imports) as parse_stub:
+            records = iter_couplings(self.package_a, self.package_b)
+            next(records)
+            parsed = parse_stub.call_count
+            rest = list(records)
+            self.assertLess(parsed, parse_stub.call_count)
+        self.assertEqual(len(rest) + 1, len(main(self.package_a, self.package_b)))
+
+    def test_jsonl_output(self):
+        stream = StringIO()
+        with mock.patch('sys.stdout', stream):
+            self.assertEqual(run(['scan', self.package_a, self.package_b, '--format', 'jsonl']), 0)
+        expected = main(self.package_a, self.package_b)
+        result = {}
+        for line in stream.getvalue().splitlines():
+            record = json.loads(line)
+            source = module_meta(record['source']['package'], record['source']['pathname'])
+            result[source] = set(module_meta(dep['package'], dep['pathname'])
+                                 for dep in record['dependencies'])
+        self.assertDictEqual(result, expected)
+
+    def test_reader_that_stops_early(self):
+        # Enough output that the scan is still writing when the reader leaves.
+        base = os.path.join(gettempdir(), 'decoupy_synth')
+        self.addCleanup(shutil.rmtree, base, True)
+        package_a, package_b = generate_tree(base, modules=300, fanout=4, depth=2, seed=3)
+        environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        process = subprocess.Popen([sys.executable, '-m', 'decoupy', 'scan', package_a, package_b],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+        self.assertTrue(process.stdout.readline())
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.wait()
+        self.assertEqual(stderr, b'')
+
+
+class GraphFileTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                        MODULE_B: 'from root_package.package_a import module_b'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_graph_file_round_trip(self):
+        graph_file = os.path.join(gettempdir(), 'decoupy_test.graph')
+        self.addCleanup(os.remove, graph_file)
+        scanned = StringIO()
+        with mock.patch('sys.stdout', scanned):
+            run(['scan', self.package_a, self.package_b, '--graph-file', graph_file])
+        with GraphFile(graph_file) as loaded:
+            self.assertEqual(loaded.roots, [self.package_a, self.package_b])
+            self.assertDictEqual(loaded.to_dict(), main(self.package_a, self.package_b))
+            self.assertIn('root_package.package_b.module_a',
+                          loaded.script_imports()[os.path.join(self.package_a, MODULE_A)])
+            self.assertIn('socket', loaded.import_edges()['root_package.package_b.module_a'])
+            self.assertEqual(loaded.node_name(loaded.node('os')), 'os')
+        shown = StringIO()
+        with mock.patch('sys.stdout', shown):
+            self.assertEqual(run(['show', graph_file]), 0)
+        self.assertEqual(shown.getvalue(), scanned.getvalue())
+        with open(graph_file, 'r+b') as f:
+            f.truncate(100)
+        self.assertRaises(SnapshotError, GraphFile, graph_file)
+
+
+class SpillTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                        MODULE_B: 'from root_package.package_a import module_b'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_spilled_records_match(self):
+        database = os.path.join(gettempdir(), 'decoupy_test.db')
+        self.addCleanup(os.remove, database)
+        self.assertEqual(list(spilled_couplings([self.package_a, self.package_b], database)),
+                         list(iter_couplings(self.package_a, self.package_b)))
+        # A second run replaces its own database, with parser processes.
+        self.assertEqual(list(spilled_couplings([self.package_a, self.package_b], database, workers=2)),
+                         list(iter_couplings(self.package_a, self.package_b)))
+
+    def test_spill_keeps_other_files(self):
+        notes = os.path.join(gettempdir(), 'decoupy_test_notes.txt')
+        with open(notes, 'w') as f:
+            f.write('not a database\n')
+        self.addCleanup(os.remove, notes)
+        stderr = StringIO()
+        with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', stderr):
+            self.assertEqual(run(['scan', self.package_a, self.package_b, '--spill', notes]), 2)
+        self.assertIn('not a decoupy spill database', stderr.getvalue())
+        with open(notes) as f:
+            self.assertEqual(f.read(), 'not a database\n')
+
+
+class CouplingGraphTests(TestCase):
+
+    def test_interns_modules_and_round_trips(self):
+        shared = module_meta('pkg.mod', '/base/pkg/mod.py')
+        out = {
+            module_meta(MAIN, '/base/a.py'): set([shared, module_meta('pkg', '/base/pkg/__init__.py')]),
+            module_meta(MAIN, '/base/b.py'): set([shared]),
+        }
+        coupling = CouplingGraph.from_items(sorted(out.items()))
+        self.assertEqual(len(coupling), 2)
+        self.assertEqual(coupling.edge_count(), 3)
+        self.assertEqual(len(coupling.pathnames), 4)
+        self.assertDictEqual(coupling.to_dict(), out)
+        self.assertDictEqual(pickle.loads(pickle.dumps(coupling, pickle.HIGHEST_PROTOCOL)).to_dict(), out)
+
+
+class SyntheticTreeTests(TestCase):
+
+    def setUp(self):
+        self.base = os.path.join(gettempdir(), 'decoupy_synth')
+
+    def tearDown(self):
+        shutil.rmtree(self.base, ignore_errors=True)
+
+    def test_generated_tree_is_deterministic(self):
+        package_a, package_b = generate_tree(self.base, modules=60, fanout=4, depth=2, seed=3)
+        modules = [pathname for pathname in discover([package_a, package_b])
+                   if not pathname.endswith(INIT_FILE)]
+        self.assertEqual(len(modules), 60)
+        first = main(package_a, package_b)
+        self.assertTrue(first)
+        generate_tree(self.base, modules=60, fanout=4, depth=2, seed=3)
+        self.assertDictEqual(main(package_a, package_b), first)
+
+
+class ShardTests(TestCase):
+
+    def setUp(self):
+        self.base = os.path.join(gettempdir(), 'decoupy_synth')
+
+    def tearDown(self):
+        shutil.rmtree(self.base, ignore_errors=True)
+
+    def test_shards_merge_into_the_single_node_result(self):
+        package_a, package_b = generate_tree(self.base, modules=60, fanout=4, depth=2, seed=3)
+        environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        parts = [os.path.join(self.base, 'part%d' % i) for i in range(3)]
+        processes = [subprocess.Popen([sys.executable, '-m', 'decoupy', 'scan', package_a, package_b,
+                                       '--shard', '%d/3' % (i + 1), '--graph-file', part],
+                                      stdout=subprocess.PIPE, env=environment)
+                     for i, part in enumerate(parts)]
+        outputs = [process.communicate()[0] for process in processes]
+        self.assertEqual([process.returncode for process in processes], [0, 0, 0])
+        self.assertTrue(all(outputs))
+        merged = merge_graph_files(reversed(parts))
+        self.assertDictEqual(merged.to_dict(), main(package_a, package_b))
+        self.assertEqual([source for source, dependencies in merged],
+                         [source for source, dependencies in iter_couplings(package_a, package_b)])
+        self.assertRaises(MergeError, merge_graph_files, parts[:2])
+
+    def test_snapshot_is_refused(self):
+        package_a, package_b = generate_tree(self.base, modules=60, fanout=4, depth=2, seed=3)
+        with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', StringIO()):
+            self.assertEqual(run(['scan', package_a, package_b, '--shard', '1/3',
+                                  '--snapshot', os.path.join(self.base, 'snapshot')]), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.base, 'snapshot')))
+
+
+class ProfilerTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os, socket'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import os'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_counters_and_slowest_modules(self):
+        events = []
+        profiler = Profiler(slowest=2, callback=lambda event, name, seconds: events.append(event))
+        result = main(self.package_a, self.package_b, profiler=profiler)
+        report = profiler.report()
+        self.assertEqual(report['counters']['files_found'], 5)
+        self.assertEqual(report['counters']['modules_parsed'], 5)
+        self.assertEqual(report['counters']['external_modules'], 3)
+        self.assertEqual(report['counters']['sources_emitted'], len(result))
+        self.assertEqual(report['counters']['edges_emitted'], sum(len(deps) for deps in result.values()))
+        self.assertEqual(len(report['slowest']), 2)
+        self.assertEqual(set(events), set(['phase', 'module']))
+        self.assertAlmostEqual(report['total'], sum(report['phases'].values()))
+
+
+class CouplingMatrixTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.roots = [os.path.join(ROOT_PACKAGE, package) for package in ('package_a', 'package_b', 'package_c')]
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    'package_a': {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                    },
+                    'package_b': {
+                        INIT_FILE: '',
+                        MODULE_A: 'import root_package.package_c.module_a'
+                    },
+                    'package_c': {
+                        INIT_FILE: '',
+                        MODULE_A: 'import os'
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_two_roots_match_main(self):
+        matrix = coupling_matrix(self.roots[:2])
+        pairs = set((source, dependency) for i, j, source, dependency in matrix.iter_pairs())
+        expected = set((source, dependency) for source, dependencies
+                       in main(self.roots[0], self.roots[1]).items() for dependency in dependencies)
+        self.assertEqual(pairs, expected)
+        self.assertEqual(sum(map(sum, matrix.counts)), len(expected))
+
+    def test_all_roots_in_one_pass(self):
+        with mock.patch('decoupy.graph.file_imports', side_effect=file_imports) as parse_stub:
+            matrix = coupling_matrix(self.roots)
+        self.assertEqual(parse_stub.call_count, 6)
+        self.assertEqual(matrix.counts, [[0, 2, 2], [0, 0, 2], [0, 0, 0]])
+        self.assertEqual(set(dependency.package for source, dependency in matrix.pairs(0, 2)),
+                         set(['root_package.package_c', 'root_package.package_c.module_a']))
+
+
+    def test_top_level_packages(self):
+        # Roots that are top-level packages, absolute and spelled with a
+        # trailing separator, are named from the packages themselves.
+        mono = os.path.join(gettempdir(), 'decoupy_mono')
+        build_package_tree(
+            {
+                mono: {
+                    'alpha': {INIT_FILE: '', MODULE_A: 'from beta import module_a'},
+                    'beta': {INIT_FILE: '', MODULE_A: 'import gamma.module_a', MODULE_B: 'import beta.module_a'},
+                    'gamma': {INIT_FILE: '', MODULE_A: 'import os'},
+                }
+            }
+        )
+        self.addCleanup(shutil.rmtree, mono)
+        roots = [os.path.join(os.path.abspath(mono), package, '') for package in ('alpha', 'beta', 'gamma')]
+        self.assertEqual(coupling_matrix(roots).counts, [[0, 2, 2], [0, 2, 4], [0, 0, 0]])
+        self.assertEqual(coupling_matrix([roots[1]]).counts, [[2]])
+
+class DiscoveryTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: '',
+                        'data.json': '{}',
+                        'module_a.pyc': '',
+                        '.git': {'hook.py': ''},
+                        'vendor': {'lib.py': ''},
+                        PACKAGE_B: {
+                            INIT_FILE: '',
+                            MODULE_B: ''
+                        }
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def relative(self, pathnames):
+        return sorted(os.path.relpath(pathname, self.package_a) for pathname in pathnames)
+
+    def test_only_python_files_outside_excluded_dirs(self):
+        self.assertEqual(self.relative(discover([self.package_a], ['.*/', 'vendor/'])),
+                         [INIT_FILE, MODULE_A, os.path.join(PACKAGE_B, INIT_FILE), os.path.join(PACKAGE_B, MODULE_B)])
+
+    def test_overlapping_roots_and_symlink_loops(self):
+        os.symlink(self.package_a, os.path.join(self.package_a, PACKAGE_B, 'loop'))
+        nested = os.path.join(self.package_a, PACKAGE_B)
+        pathnames = list(discover([self.package_a, nested, self.package_a + '/']))
+        self.assertEqual(len(pathnames), len(set(pathnames)))
+        self.assertEqual(len(pathnames), 5)
+
+    def test_gitignore_patterns(self):
+        rules = ExcludeRules(['*.py', '!keep.py', '/top/', 'docs/**/build', '# comment'])
+        self.assertTrue(rules.match('pkg/module.py'))
+        self.assertFalse(rules.match('pkg/keep.py'))
+        self.assertTrue(rules.match('top', True))
+        self.assertFalse(rules.match('pkg/top', True))
+        self.assertFalse(rules.match('top'))
+        self.assertTrue(rules.match('docs/a/b/build', True))
+        self.assertTrue(rules.match('docs/build'))
+
+
+class ResolverTests(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(gettempdir(), 'decoupy_path')
+        self.cache_dir = os.path.join(gettempdir(), 'decoupy_cache')
+        build_package_tree({self.path: {'pkg': {INIT_FILE: '', 'sub.py': ''}, 'single.py': '', 'data': {}}})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_lookups_are_answered_from_listings(self):
+        resolver = Resolver()
+        missing = os.path.join(self.path, 'missing')
+        dirs = [missing, self.path]
+        with mock.patch('os.path.isfile', side_effect=os.path.isfile) as isfile_stub:
+            self.assertEqual(resolver.find('pkg', dirs), (os.path.join(self.path, 'pkg', INIT_FILE),
+                                                          [os.path.join(self.path, 'pkg')]))
+            self.assertEqual(resolver.find('single', dirs), (os.path.join(self.path, 'single.py'), None))
+            self.assertIsNone(resolver.find('data', dirs))
+            self.assertIsNone(resolver.find('data', dirs))
+            self.assertEqual(resolver.find('sys', dirs, builtins=True), (None, None))
+        self.assertEqual(isfile_stub.call_count, 1)
+        self.assertEqual(resolver.listed, 4)
+        self.assertEqual(resolver.hits, 1)
+
+    def test_persisted_answers_are_dropped_when_a_directory_changes(self):
+        resolver = Resolver(self.cache_dir)
+        self.assertIsNone(resolver.find('later', [self.path]))
+        resolver.save()
+        self.assertIn(('later', (self.path,)), Resolver(self.cache_dir).resolved)
+        make_file(os.path.join(self.path, 'later.py'), '')
+        os.utime(self.path, (0, 0))
+        resolver = Resolver(self.cache_dir)
+        self.assertEqual(resolver.find('later', [self.path]), (os.path.join(self.path, 'later.py'), None))
+
+
+class ServerTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.socket_path = os.path.join(gettempdir(), 'decoupy_test.sock')
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os'
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def coupling(self, server):
+        return dict((module_meta(*[record['source'][key] for key in module_meta._fields]),
+                     set(module_meta(*[dependency[key] for key in module_meta._fields])
+                         for dependency in record['dependencies']))
+                    for record in server.handle({'command': 'coupling'})['records'])
+
+    def test_changes_are_applied_before_answering(self):
+        server = CouplingServer([self.package_a, self.package_b], self.socket_path, watch='poll', interval=0)
+        self.assertDictEqual(self.coupling(server), main(self.package_a, self.package_b))
+        make_file(os.path.join(self.package_a, MODULE_B), 'import root_package.package_b.module_a, os')
+        make_file(os.path.join(self.package_b, 'module_c.py'), 'from root_package.package_a import module_b')
+        self.assertDictEqual(self.coupling(server), main(self.package_a, self.package_b))
+        self.assertEqual(server.handle({'command': 'dependents', 'package': 'root_package.package_b.module_a'}),
+                         {'sources': sorted([os.path.join(self.package_a, MODULE_A),
+                                             os.path.join(self.package_a, MODULE_B),
+                                             os.path.join(self.package_b, 'module_c.py')])})
+
+    def test_queries_over_the_socket(self):
+        server = CouplingServer([self.package_a, self.package_b], self.socket_path, watch='poll')
+        server.bind()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            pathname = os.path.join(self.package_a, MODULE_A)
+            response = query(self.socket_path, {'command': 'coupling', 'pathname': pathname}, timeout=10)
+            self.assertTrue(response['ok'])
+            self.assertEqual([record['source']['pathname'] for record in response['records']], [pathname])
+            self.assertFalse(query(self.socket_path, {'command': 'bogus'}, timeout=10)['ok'])
+            response = query(self.socket_path, {'command': 'why', 'source': pathname,
+                                                'target': 'root_package.package_b.module_a'}, timeout=10)
+            self.assertEqual(response['chain'], [pathname, 'root_package.package_b.module_a'])
+        finally:
+            query(self.socket_path, {'command': 'shutdown'}, timeout=10)
+            thread.join(10)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_query_without_server(self):
+        stderr = StringIO()
+        with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', stderr):
+            self.assertEqual(run(['query', 'ping', '--socket', self.socket_path]), 2)
+        self.assertEqual(stderr.getvalue(), 'decoupy: no server on %s\n' % self.socket_path)
+
+    def test_query_to_a_busy_server(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(os.remove, self.socket_path)
+        self.addCleanup(listener.close)
+        listener.bind(self.socket_path)
+        listener.listen(1)
+        stderr = StringIO()
+        with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', stderr):
+            self.assertEqual(run(['query', 'ping', '--socket', self.socket_path, '--timeout', '0.1']), 2)
+        self.assertIn('did not answer', stderr.getvalue())
+
+
+class ReachabilityTests(TestCase):
+
+    def setUp(self):
+        self.base = os.path.join(gettempdir(), 'decoupy_synth')
+
+    def tearDown(self):
+        shutil.rmtree(self.base, ignore_errors=True)
+
+    def test_matches_closures_and_explains_with_shortest_chains(self):
+        roots = generate_tree(self.base, modules=80, fanout=4, depth=2, cycle_density=0.3, seed=5)
+        graph = new_graph(roots)
+        out = graph_coupling(graph).to_dict()
+        index = ReachabilityIndex(graph)
+        closures = strongly_connected_closures(graph.edges)
+        for x in graph.edges:
+            for y in graph.edges:
+                expected = y in closures[x] and (x != y or any(x in closures[succ] for succ in graph.edges[x]))
+                self.assertEqual(index.depends_on(x, y), expected)
+                chain = index.chain(x, y)
+                if not expected:
+                    self.assertIsNone(chain)
+                    continue
+                self.assertEqual((chain[0], chain[-1]), (x, y))
+                for source, target in zip(chain, chain[1:]):
+                    self.assertIn(target, graph.edges[source])
+        for source, dependencies in out.items():
+            for dependency in dependencies:
+                self.assertTrue(index.depends_on(source.pathname, dependency.pathname))
+                self.assertEqual(index.chain(source.pathname, dependency.package)[0], source.pathname)
+        self.assertRaises(KeyError, index.depends_on, 'no.such.module', 'os')
+
+    def test_chain_is_shortest(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.addCleanup(shutil.rmtree, ROOT_PACKAGE)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import root_package.package_a.module_b, root_package.package_b.module_b',
+                        MODULE_B: 'import root_package.package_a.module_c',
+                        'module_c.py': 'import root_package.package_b.module_b',
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import os',
+                        MODULE_B: 'import root_package.package_b.module_a',
+                    }
+                }
+            }
+        )
+        package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        graph = new_graph([package_a, os.path.join(ROOT_PACKAGE, PACKAGE_B)])
+        build_graph(graph)
+        index = ReachabilityIndex(graph)
+        self.assertEqual(index.chain(os.path.join(package_a, MODULE_A), 'root_package.package_b.module_a'),
+                         [os.path.join(package_a, MODULE_A), 'root_package.package_b.module_b',
+                          'root_package.package_b.module_a'])
+        self.assertFalse(index.depends_on('root_package.package_b.module_a', 'root_package.package_a.module_a'))
+        self.assertFalse(index.depends_on(os.path.join(package_a, MODULE_B), 'root_package.package_a.module_b'))
+
+    def test_why_without_snapshot(self):
+        stderr = StringIO()
+        with mock.patch('sys.stdout', StringIO()), mock.patch('sys.stderr', stderr):
+            self.assertEqual(run(['why', os.path.join(self.base, 'missing.snapshot'), 'a', 'b']), 2)
+        self.assertIn('No such file or directory', stderr.getvalue())
+
+
+class RuleTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        self.rules = os.path.join(gettempdir(), 'decoupy_test.rules')
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import root_package.package_b.module_a',
+                        MODULE_B: 'import os',
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import root_package.package_b.module_b',
+                        MODULE_B: 'from root_package.package_a import module_b',
+                    }
+                }
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+        if os.path.exists(self.rules):
+            os.remove(self.rules)
+
+    def test_patterns(self):
+        trie = PatternTrie()
+        for bit, pattern in enumerate(['pkg.**', 'pkg.*.api', 'pkg.mod', '**.test_*', 'pkg.**.api']):
+            trie.add(pattern, bit)
+        self.assertEqual(trie.match('pkg'), 0b00001)
+        self.assertEqual(trie.match('pkg.mod'), 0b00101)
+        self.assertEqual(trie.match('pkg.sub.api'), 0b10011)
+        self.assertEqual(trie.match('pkg.a.b.api'), 0b10001)
+        self.assertEqual(trie.match('other.test_x'), 0b01000)
+        self.assertEqual(trie.match('other'), 0)
+
+    def test_transitive_violations_and_exceptions(self):
+        graph = new_graph([self.package_a, self.package_b])
+        build_graph(graph)
+        edges = module_edges(graph)
+        rules = parse_rules(['# layering', 'forbid root_package.package_b.** -> root_package.package_a.**'])
+        found = sorted((v.source, v.chain) for v in RuleSet(rules).check(edges))
+        self.assertEqual(found, [
+            ('root_package.package_b.module_a', ['root_package.package_b.module_a', 'root_package.package_b.module_b',
+                                                 'root_package.package_a']),
+            ('root_package.package_b.module_b', ['root_package.package_b.module_b', 'root_package.package_a']),
+        ])
+        # The exception covers module_b itself, not what depends on it.
+        rules.extend(parse_rules(['allow root_package.package_b.module_b -> root_package.package_a.**']))
+        self.assertEqual([v.source for v in RuleSet(rules).check(edges)], ['root_package.package_b.module_a'])
+        self.assertRaises(RuleError, parse_rules, ['deny a -> b'])
+
+    def test_check_exit_code(self):
+        make_file(self.rules, 'forbid root_package.package_a.** -> root_package.package_b.**\n')
+        stream = StringIO()
+        with mock.patch('sys.stdout', stream):
+            self.assertEqual(run(['check', self.rules, self.package_a, self.package_b]), 1)
+        self.assertIn('    root_package.package_a.module_a -> root_package.package_b\n', stream.getvalue())
+        make_file(self.rules, 'forbid root_package.package_b.** -> os\n')
+        with mock.patch('sys.stdout', StringIO()):
+            self.assertEqual(run(['check', self.rules, self.package_a, self.package_b]), 1)
+        make_file(self.rules, 'forbid root_package.package_a.** -> socket\n')
+        with mock.patch('sys.stdout', StringIO()):
+            self.assertEqual(run(['check', self.rules, self.package_a, self.package_b]), 0)
+
+
+class RevisionDiffTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.package_b = os.path.join(ROOT_PACKAGE, PACKAGE_B)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: 'from root_package.package_b import module_a',
+                        MODULE_B: 'import os',
+                    },
+                    PACKAGE_B: {
+                        INIT_FILE: '',
+                        MODULE_A: 'import socket',
+                        MODULE_B: 'import os',
+                    }
+                }
+            }
+        )
+        self.git('init', '-q')
+        self.commit()
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def git(self, *args):
+        subprocess.check_call(('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args,
+                              cwd=ROOT_PACKAGE)
+
+    def commit(self):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'revision')
+
+    def test_update_from_git_sees_renames(self):
+        snapshot = os.path.join(gettempdir(), 'decoupy_git.snapshot')
+        self.addCleanup(os.remove, snapshot)
+        main(self.package_a, self.package_b, snapshot=snapshot)
+        self.git('mv', os.path.join(PACKAGE_A, MODULE_A), os.path.join(PACKAGE_A, 'renamed.py'))
+        self.commit()
+        result = update(snapshot, [], git='HEAD~1..HEAD')
+        self.assertNotIn(module_meta(MAIN, os.path.join(self.package_a, MODULE_A)), result)
+        self.assertDictEqual(result, main(self.package_a, self.package_b))
+
+    def test_matches_a_scan_of_each_revision(self):
+        old = main(self.package_a, self.package_b)
+        make_file(os.path.join(self.package_b, MODULE_B), 'from root_package.package_a import module_b')
+        make_file(os.path.join(self.package_b, 'module_c.py'), 'import root_package.package_b.module_b')
+        os.remove(os.path.join(self.package_a, MODULE_A))
+        self.commit()
+        new = main(self.package_a, self.package_b)
+        # The work tree is not read: only the revisions are compared.
+        make_file(os.path.join(self.package_b, MODULE_A), 'import root_package.package_a.module_b')
+        old_edges = set((source, dependency) for source, dependencies in old.items() for dependency in dependencies)
+        new_edges = set((source, dependency) for source, dependencies in new.items() for dependency in dependencies)
+        added, removed = diff_revisions('HEAD~1', 'HEAD', [self.package_a, self.package_b])
+        self.assertEqual(added, sorted(new_edges - old_edges))
+        self.assertEqual(removed, sorted(old_edges - new_edges))
+        in_a = lambda pathname: pathname.startswith(self.package_a + os.sep)
+        self.assertEqual(diff_revisions('HEAD~1', 'HEAD', [self.package_a, self.package_b], cross=True),
+                         (sorted(edge for edge in new_edges - old_edges if in_a(edge[0][1]) != in_a(edge[1][1])),
+                          sorted(edge for edge in old_edges - new_edges if in_a(edge[0][1]) != in_a(edge[1][1]))))
+        self.assertTrue(removed)
+
+
+    def test_package_layout_of_each_revision(self):
+        old = main(self.package_a, self.package_b)
+        # The new revision drops the root package, so every module is renamed.
+        os.remove(os.path.join(ROOT_PACKAGE, INIT_FILE))
+        make_file(os.path.join(self.package_a, MODULE_A), 'from package_b import module_a')
+        self.commit()
+        new = main(self.package_a, self.package_b)
+        make_file(os.path.join(ROOT_PACKAGE, INIT_FILE), '')
+        old_edges = set((source, dependency) for source, dependencies in old.items() for dependency in dependencies)
+        new_edges = set((source, dependency) for source, dependencies in new.items() for dependency in dependencies)
+        added, removed = diff_revisions('HEAD~1', 'HEAD', [self.package_a, self.package_b])
+        self.assertEqual(added, sorted(new_edges - old_edges))
+        self.assertEqual(removed, sorted(old_edges - new_edges))
+        self.assertIn('package_b.module_a', set(dependency.package for source, dependency in added))
+
+class StartupTests(TestCase):
+    # Hooks run decoupy on every commit, so the command line has to start
+    # without loading the analysis.
+    heavy_modules = ('decoupy.main', 'decoupy.graph', 'decoupy.server', 'multiprocessing', 'json', 'pickle')
+
+    def run_decoupy(self, *args, **kwargs):
+        environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        interpreter = kwargs.get('interpreter', sys.executable)
+        process = subprocess.Popen([interpreter] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   env=environment, universal_newlines=True)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout, stderr
+
+    def test_command_line_imports_no_analysis(self):
+        stdout, stderr = self.run_decoupy('-c', 'import sys, decoupy.cli; '
+                                                'decoupy.cli.build_parser(); print(" ".join(sys.modules))')
+        loaded = set(stdout.split())
+        self.assertIn('decoupy.cli', loaded)
+        for name in self.heavy_modules:
+            self.assertNotIn(name, loaded)
+
+    def importtime_interpreter(self):
+        # -X importtime needs Python 3.7; the suite itself may run on an
+        # older interpreter, so one is looked for on PATH.
+        candidates = [sys.executable, 'python3'] + ['python3.%d' % minor for minor in range(15, 6, -1)]
+        for candidate in candidates:
+            try:
+                process = subprocess.Popen([candidate, '-c', 'import sys; print(sys.version_info >= (3, 7))'],
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                           universal_newlines=True)
+            except OSError:
+                continue
+            if process.communicate()[0].strip() == 'True':
+                return candidate
+        self.skipTest('-X importtime needs Python 3.7 and none was found on PATH')
+
+    def test_help_import_time_budget(self):
+        interpreter = self.importtime_interpreter()
+        stdout, stderr = self.run_decoupy('-X', 'importtime', '-m', 'decoupy', '--help', interpreter=interpreter)
+        self.assertIn('usage: decoupy', stdout)
+        # "import time: self [us] | cumulative | imported package", nested
+        # imports indented under the one that caused them.
+        total = 0
+        for line in stderr.splitlines():
+            fields = line.split('|')
+            if line.startswith('import time:') and fields[-1].startswith(' decoupy'):
+                total += int(fields[1])
+        self.assertLess(total, 100000)
+
+
+class ScannerTests(TestCase):
+
+    def test_imports_at_any_depth(self):
+        imports = source_imports(norm_indent("""
+                    import os, root_package.package_b as b
+                    def baz():
+                        from root_package.package_b import module_a
+                        class Inner(object):
+                            import socket
+                  """))
+        self.assertEqual(sorted(imports), sorted([
+            (-1, None, 'os'),
+            (-1, None, 'root_package.package_b'),
+            (-1, ('module_a',), 'root_package.package_b'),
+            (-1, None, 'socket'),
+        ]))
+
+    def test_relative_imports(self):
+        imports = source_imports(norm_indent("""
+                    from . import module_a
+                    from ..package_b import module_b, module_c
+                  """))
+        self.assertEqual(imports, [(1, ('module_a',), ''), (2, ('module_b', 'module_c'), 'package_b')])
+
+    def test_file_with_coding_cookie(self):
+        pathname = os.path.join(gettempdir(), 'decoupy_latin1.py')
+        with open(pathname, 'wb') as f:
+            f.write(b'# -*- coding: latin-1 -*-\nimport os\nname = "caf\xe9"\n')
+        self.addCleanup(os.remove, pathname)
+        self.assertEqual(file_imports(pathname), [(-1 if sys.version_info[0] == 2 else 0, None, 'os')])
+
+    def test_absolute_import_future(self):
+        imports = source_imports(norm_indent("""
+                    \"\"\"Docstring.\"\"\"
+                    from __future__ import absolute_import
+                    import os
+                  """))
+        self.assertEqual(imports, [(0, ('absolute_import',), '__future__'), (0, None, 'os')])
+
+
+class ModuleIndexTests(TestCase):
+
+    def setUp(self):
+        global ROOT_PACKAGE
+        ROOT_PACKAGE = os.path.join(gettempdir(), ROOT)
+        build_package_tree(
+            {
+                ROOT_PACKAGE: {
+                    INIT_FILE: '',
+                    PACKAGE_A: {
+                        INIT_FILE: '',
+                        MODULE_A: '',
+                        PACKAGE_B: {
+                            INIT_FILE: '',
+                            MODULE_B: ''
+                        },
+                        'data': {
+                            'fixture.txt': ''
+                        }
+                    }
+                }
+            }
+        )
+        self.package_a = os.path.join(ROOT_PACKAGE, PACKAGE_A)
+        self.index = ModuleIndex(gettempdir(), [self.package_a])
+
+    def tearDown(self):
+        shutil.rmtree(ROOT_PACKAGE)
+
+    def test_dotted_name(self):
+        self.assertEqual(dotted_name('/base/pkg/sub/__init__.py', '/base'), 'pkg.sub')
+        self.assertEqual(dotted_name('/base/pkg/mod.py', '/base'), 'pkg.mod')
+        self.assertIsNone(dotted_name('/elsewhere/mod.py', '/base'))
+
+    def test_lookups_both_ways(self):
+        name = '.'.join([ROOT, PACKAGE_A, PACKAGE_B, 'module_b'])
+        pathname = os.path.join(self.package_a, PACKAGE_B, MODULE_B)
+        self.assertEqual(self.index.lookup(name), pathname)
+        self.assertEqual(self.index.name_for(pathname), name)
+        self.assertTrue(self.index.is_package('.'.join([ROOT, PACKAGE_A, PACKAGE_B])))
+        self.assertIsNone(self.index.lookup('.'.join([ROOT, PACKAGE_A, 'data', 'fixture'])))
+
+    def test_init_chain(self):
+        self.assertEqual(self.index.init_chain('.'.join([ROOT, PACKAGE_A, PACKAGE_B, 'module_b'])),
+                         [os.path.join(self.package_a, INIT_FILE),
+                          os.path.join(self.package_a, PACKAGE_B, INIT_FILE)])
+
+    def test_contains_uses_path_prefix(self):
+        self.assertTrue(self.index.contains(os.path.join(self.package_a, 'data', 'fixture.txt')))
+        self.assertFalse(self.index.contains(self.package_a + '_old/module_a.py'))
+
+    def test_owns_names_below_indexed_packages(self):
+        self.assertTrue(self.index.owns('.'.join([ROOT, PACKAGE_A, 'os'])))
+        self.assertFalse(self.index.owns(ROOT))
+        self.assertFalse(self.index.owns('os'))